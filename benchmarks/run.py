@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 # Copyright 2017 Google Inc. All rights reserved.
 #
 # Licensed under the Apache License, Version 2.0 (the "License");
@@ -13,80 +13,393 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from __future__ import print_function
+"""Benchmarks glop against the grammars in grammars/.
+
+For each grammar, the time it takes to parse the grammar, analyze it,
+generate the code for its parser, and exec that code are measured
+separately, and then the time it takes the parser to parse generated
+inputs of increasing sizes. The code generation and the parsing are
+measured both with and without memoization.
+
+Each step is timed a few times and the best time is kept, and then it
+is run once more with tracemalloc on to find the peak memory it uses.
+The results can be written out as JSON with -o, and then compared to
+in a later run (e.g., on another commit) with -b.
+
+With --scaling, random inputs are generated from each grammar instead
+(see glop.generator), at sizes from 1 KB up to 100 MB (or until parsing
+one takes longer than --max-seconds), and the parse times and peak
+memory are fit to a power of the input size. A grammar whose parse time
+grows faster than linearly (by more than --max-exponent) is flagged,
+since that usually means the parser is backtracking over more and more
+of the input.
+"""
 
 import argparse
+import json
+import math
 import os
+import random
 import sys
 import time
+import tracemalloc
 
 
 THIS_DIR = os.path.abspath(os.path.dirname(__file__))
-REPO_DIR  = os.path.dirname(THIS_DIR)
+REPO_DIR = os.path.dirname(THIS_DIR)
 
 if not REPO_DIR in sys.path:
     sys.path.insert(0, REPO_DIR)
 
 from glop.analyzer import Analyzer
 from glop.compiler import Compiler
+from glop.generator import Generator
 from glop.parser import Parser
+from glop.version import VERSION
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('-b', '--baseline', metavar='FILE',
+                            help='compare the times with the ones in FILE '
+                                 '(written by an earlier run with -o)')
+    arg_parser.add_argument('-g', '--grammar', action='append',
+                            choices=sorted(INPUTS),
+                            help='the grammars to benchmark (may be given '
+                                 'more than once; defaults to all of them)')
+    arg_parser.add_argument('--max-exponent', type=float, default=1.2,
+                            help='with --scaling, flag the grammars whose '
+                                 'parse times grow faster than the input '
+                                 'size to this power (default is '
+                                 '%(default)s)')
+    arg_parser.add_argument('--max-seconds', type=float, default=60,
+                            help='with --scaling, stop making the inputs '
+                                 'bigger once one takes this long to parse '
+                                 '(default is %(default)s)')
+    arg_parser.add_argument('--memoize', choices=['on', 'off', 'both'],
+                            default='both',
+                            help='whether to memoize (default is '
+                                 '%(default)s)')
+    arg_parser.add_argument('-o', '--output', metavar='FILE',
+                            help='write the results to FILE as JSON')
+    arg_parser.add_argument('-r', '--repeat', type=int, default=3,
+                            help='number of times to time each step '
+                                 '(default is %(default)s)')
+    arg_parser.add_argument('-s', '--sizes',
+                            help='comma-separated sizes of the inputs to '
+                                 'parse, in characters (default is '
+                                 '%s, or %s with --scaling)' %
+                                 (_SIZES, _SCALING_SIZES))
+    arg_parser.add_argument('--scaling', action='store_true',
+                            help='measure how the parse times grow with '
+                                 'the size of generated inputs')
+    arg_parser.add_argument('--seed', type=int, default=1,
+                            help='seed for generating the inputs')
+    args = arg_parser.parse_args(argv)
+
+    sizes = args.sizes or (_SCALING_SIZES if args.scaling else _SIZES)
+    sizes = [int(s) for s in sizes.split(',')]
+    memoize = {'on': [True], 'off': [False], 'both': [True, False]}
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = {_key(r): r for r in json.load(fp)['results']}
+
+    results = []
+    print(_HEADER)
+    for name in args.grammar or sorted(INPUTS):
+        if args.scaling:
+            steps = _bench_scaling(name, memoize[args.memoize], sizes,
+                                   args.repeat, args.seed, args.max_seconds,
+                                   args.max_exponent)
+        else:
+            steps = _bench_grammar(name, memoize[args.memoize], sizes,
+                                   args.repeat, args.seed)
+        for result in steps:
+            results.append(result)
+            print(_row(result, baseline.get(_key(result))))
+            sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'version': VERSION,
+                       'python': sys.version.split()[0],
+                       'results': results}, fp, indent=2)
+            fp.write('\n')
+    return 1 if any('error' in r or r.get('super_linear')
+                    for r in results) else 0
+
+
+_SIZES = '1000,10000,100000'
+
+_SCALING_SIZES = '1000,10000,100000,1000000,10000000,100000000'
+
+
+def _bench_grammar(name, memoize_values, sizes, repeat, seed):
+    """Yields the results for each step for the given grammar."""
+    path = os.path.join(REPO_DIR, 'grammars', name + '.g')
+    with open(path) as fp:
+        grammar_txt = fp.read()
+
+    # Parsing and analyzing the grammar don't depend on memoization.
+    r, value = _measure(name, None, 'parse grammar', len(grammar_txt),
+                        repeat, lambda: Parser(grammar_txt, path).parse())
+    yield r
+    if 'error' in r:
+        return
+    ast = value[0]
+    r, value = _measure(name, None, 'analyze', len(grammar_txt), repeat,
+                        lambda: Analyzer().analyze(ast))
+    yield r
+    if 'error' in r:
+        return
+    grammar = value[0]
+
+    inputs = [(size,) + INPUTS[name](random.Random(seed), size)
+              for size in sizes]
+    for memoize in memoize_values:
+        r, value = _measure(name, memoize, 'compile', len(grammar_txt),
+                            repeat,
+                            lambda: Compiler(grammar, 'Parser',
+                                             main_wanted=False,
+                                             memoize=memoize).compile())
+        yield r
+        if 'error' in r:
+            return
+        compiled_text = value[0]
+        r, scope = _measure(name, memoize, 'exec', len(compiled_text),
+                            repeat, lambda: _exec(compiled_text))
+        yield r
+        if 'error' in r:
+            return
+        parser_cls = scope['Parser']
+
+        for size, input_txt, global_vars in inputs:
+            r, _ = _measure(
+                name, memoize, 'parse input', len(input_txt), repeat,
+                lambda: parser_cls(input_txt, '<input>').parse(global_vars))
+            r['size'] = size
+            yield r
 
 
-def main():
-    DEFAULT_DURATION = 10
-    arg_parser = argparse.ArgumentParser()
-    arg_parser.add_argument('--memoize', action='store_true')
-    arg_parser.add_argument('-d', '--duration', type=float,
-         default=DEFAULT_DURATION,
-         help='# of seconds to run for (default is %(default)s)')
-    args = arg_parser.parse_args()
-    path = os.path.join(REPO_DIR, 'grammars', 'glop.g')
+def _bench_scaling(name, memoize_values, sizes, repeat, seed, max_seconds,
+                   max_exponent):
+    """Yields the results for parsing generated inputs of each size with
+    the given grammar, and then a result with the exponents that the
+    times and peak memory grow with."""
+    path = os.path.join(REPO_DIR, 'grammars', name + '.g')
     with open(path) as fp:
-        contents = fp.read()
+        grammar, _ = Analyzer().analyze(Parser(fp.read(), path).parse()[0])
+    global_vars = GLOBAL_VARS.get(name)
+
+    for memoize in memoize_values:
+        compiled_text, _ = Compiler(grammar, 'Parser', main_wanted=False,
+                                    memoize=memoize).compile()
+        parser_cls = _exec(compiled_text)['Parser']
+        points = []
+        for size in sizes:
+            input_txt = Generator(grammar, seed, global_vars).generate(size)
+            r, _ = _measure(
+                name, memoize, 'parse generated', len(input_txt), repeat,
+                lambda: parser_cls(input_txt, '<input>').parse(global_vars))
+            r['size'] = size
+            yield r
+            if 'error' in r:
+                break
+            points.append(r)
+            if r['seconds'] > max_seconds:
+                break
+
+        if len(points) > 1:
+            time_exponent = _exponent(points, 'seconds')
+            yield {'grammar': name, 'memoize': memoize, 'step': 'fit',
+                   'chars': points[-1]['chars'],
+                   'time_exponent': time_exponent,
+                   'memory_exponent': _exponent(points, 'peak_bytes'),
+                   'super_linear': time_exponent > max_exponent}
+
 
-    iterations = 0
+def _exponent(points, field):
+    """Returns the slope of the least-squares fit of log(field) against
+    log(chars), i.e., the k in field ~ chars ** k."""
+    xs = [math.log(p['chars']) for p in points]
+    ys = [math.log(max(p[field], 1e-9)) for p in points]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    return (sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) /
+            sum((x - mean_x) ** 2 for x in xs))
+
+
+def _exec(compiled_text):
     scope = {}
-    parser = Parser(contents, path)
-    ast, err, nextpos = parser.parse()
-    if err:
-        print(err, file=sys.stderr)
-        return 1
-    grammar, err = Analyzer().analyze(ast)
-    if err:
-        print(err, file=sys.stderr)
-        return 1
-    comp = Compiler(grammar, 'Glop', main_wanted=False, memoize=args.memoize)
-    compiled_text, err = comp.compile()
-    if err:
-        print(err, file=sys.stderr)
-        return 1
-    exec compiled_text in scope
-    parser_cls = scope['Glop']
-
-    start_time = time.time()
-    stop_time = time.time()
-    while stop_time - start_time < args.duration:
-        parser = parser_cls(contents, path)
-        ast, err, nextpos = parser.parse()
-        if err:
-            print(err, file=sys.stderr)
-            return 1
-        grammar, err = Analyzer().analyze(ast)
-        if err:
-            print(err, file=sys.stderr)
-            return 1
-        comp = Compiler(grammar, 'Glop', main_wanted=False, memoize=False)
-        _, err = comp.compile()
-        if err:
-            print(err, file=sys.stderr)
-            return 1
-        stop_time = time.time()
-        iterations += 1
-
-    print('%.1f iterations' % (iterations * DEFAULT_DURATION /
-                               (stop_time - start_time)))
-
-    return 0
+    exec(compiled_text, scope)
+    return scope
+
+
+def _measure(name, memoize, step, chars, repeat, fn):
+    """Returns the result for timing fn(), and the value fn() returned.
+
+    A step that raises an exception (e.g., a parse that recurses too
+    deeply) or returns an error (as the second item of a tuple) is
+    reported as an error rather than stopping the benchmarks."""
+    result = {'grammar': name, 'memoize': memoize, 'step': step,
+              'chars': chars}
+    times = []
+    value = None
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            value = fn()
+            times.append(time.perf_counter() - start)
+            if isinstance(value, tuple) and value[1]:
+                result['error'] = str(value[1])
+                return result, value
+
+        # Tracing slows everything down, so the peak memory is measured
+        # separately from the times.
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    except Exception as e:  # pylint: disable=broad-except
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+        return result, value
+
+    result['seconds'] = min(times)
+    result['chars_per_second'] = chars / max(min(times), 1e-9)
+    result['peak_bytes'] = peak
+    return result, value
+
+
+def _key(result):
+    # The inputs are matched up by the sizes asked for, since the sizes of
+    # the inputs generated may change (as may the size of the generated
+    # code).
+    return (result['grammar'], result['memoize'], result['step'],
+            result.get('size'))
+
+
+_HEADER = ('%-12s %-7s %-15s %9s %10s %12s %10s  %s' %
+           ('grammar', 'memoize', 'step', 'chars', 'time (s)', 'chars/s',
+            'peak (KB)', 'vs. baseline'))
+
+
+def _row(result, old_result):
+    memoize = {None: '-', True: 'on', False: 'off'}[result['memoize']]
+    prefix = '%-12s %-7s %-15s %9d' % (result['grammar'], memoize,
+                                        result['step'], result['chars'])
+    if 'error' in result:
+        return '%s  error: %s' % (prefix, result['error'])
+    if result['step'] == 'fit':
+        return '%s  time ~ n^%.2f, memory ~ n^%.2f%s' % (
+            prefix, result['time_exponent'], result['memory_exponent'],
+            '  SUPER-LINEAR' if result['super_linear'] else '')
+    row = '%s %10.4f %12.0f %10.1f' % (prefix, result['seconds'],
+                                       result['chars_per_second'],
+                                       result['peak_bytes'] / 1024.0)
+    if old_result and 'seconds' in old_result:
+        row += '  %+.1f%%' % (100.0 * (result['seconds'] /
+                                       old_result['seconds'] - 1))
+    return row
+
+
+#
+# Generators for inputs of (at least) a given size for each grammar. Each
+# returns a (text, global_vars) tuple.
+#
+
+def _glop_input(rnd, size):
+    # Rules from glop's own grammar, in a random order, as many times
+    # as needed.
+    with open(os.path.join(REPO_DIR, 'grammars', 'glop.g')) as fp:
+        rules = [r.strip() + '\n\n' for r in fp.read().split('\n\n')
+                 if r.strip()]
+    text = ''
+    while len(text) < size:
+        text += rnd.choice(rules)
+    return text, None
+
+
+def _json5_input(rnd, size):
+    members = []
+    n = 0
+    while n < size:
+        member = '%s: %s' % (_json5_key(rnd), _json5_value(rnd, 3))
+        members.append(member)
+        n += len(member) + 4
+    return '{\n  ' + ',\n  '.join(members) + ',\n}\n', None
+
+
+def _json5_key(rnd):
+    key = rnd.choice(['foo', 'bar', 'baz', 'name', 'id']) + str(
+        rnd.randint(0, 99))
+    return rnd.choice([key, '"%s"' % key, "'%s'" % key])
+
+
+def _json5_value(rnd, depth):
+    kind = rnd.randint(0, 9 if depth else 6)
+    if kind == 0:
+        return rnd.choice(['null', 'true', 'false'])
+    if kind in (1, 2):
+        return rnd.choice(['0', '12', '3.25', '.5', '1e10', '2.5E-3',
+                           '0xff'])
+    if kind in (3, 4, 5, 6):
+        return rnd.choice(['"hello, world"', "'single'", '"a \'b\' c"',
+                           '""'])
+    if kind in (7, 8):
+        return '[%s]' % ', '.join(_json5_value(rnd, depth - 1)
+                                  for _ in range(rnd.randint(0, 4)))
+    return '{%s}' % ', '.join('%s: %s' % (_json5_key(rnd),
+                                          _json5_value(rnd, depth - 1))
+                              for _ in range(rnd.randint(0, 3)))
+
+
+def _ninja_input(rnd, size):
+    lines = ['# generated', 'cflags = -O2 -Wall', '',
+             'rule cc', '  command = gcc $cflags -c $in -o $out',
+             '  description = CC $out', '',
+             'rule link', '  command = gcc $in -o $out', '']
+    n = 0
+    i = 0
+    while n < size:
+        i += 1
+        block = ['build obj/f%d.o: cc src/f%d.c | src/f%d.h' % (i, i, i)]
+        if rnd.random() < 0.3:
+            block.append('  cflags = -O0 -g')
+        if rnd.random() < 0.1:
+            block.append('build bin/p%d: link obj/f%d.o $' % (i, i))
+            block.append('    obj/f%d.o' % max(i - 1, 1))
+        lines.extend(block)
+        n += sum(len(line) + 1 for line in block)
+    lines.append('default bin/p1')
+    return '\n'.join(lines) + '\n', None
+
+
+def _var_expander_input(rnd, size):
+    words = ['the', 'quick', 'brown', 'fox', '$name', '${name}', '$$',
+             '$greeting', 'jumps', 'over', 'a', 'lazy', 'dog:']
+    text = ''
+    while len(text) < size:
+        text += rnd.choice(words) + rnd.choice([' ', ' ', '\n'])
+    return text, GLOBAL_VARS['var_expander']
+
+
+# The global variables that the grammars' actions refer to.
+GLOBAL_VARS = {
+    'var_expander': {'scope': {'name': 'world', 'greeting': 'hello'}},
+}
+
+
+INPUTS = {
+    'glop': _glop_input,
+    'json5': _json5_input,
+    'ninja': _ninja_input,
+    'var_expander': _var_expander_input,
+}
 
 
 if __name__ == '__main__':
@@ -15,12 +15,249 @@
 import collections
 
 
+# Ranges bigger than this are treated as matching any character when
+# computing FIRST sets, so that we don't build huge sets for things like
+# '\u0000'..'\uffff'.
+_MAX_RANGE_LEN = 256
+
+
 class Grammar(object):
     def __init__(self, ast):
         self.ast = ast
         self.starting_rule = ast[1][0][1]
+
+        # The rules as they're matched; the Analyzer may rewrite these into
+        # equivalent ones, while `ast` keeps them as they were written.
         self.rules = collections.OrderedDict((n[1], n[2]) for n in ast[1])
 
+        # These are filled in by the Analyzer. `first` maps each rule to
+        # the set of characters that a non-empty match of the rule can
+        # start with (or None if it could be any character), and `nullable`
+        # maps each rule to whether it can succeed without consuming input.
+        self.first = {}
+        self.nullable = {}
+
+        # Maps the rules that only ever match a single character from a
+        # fixed set of characters to those characters (see char_class()).
+        self.char_classes = {}
+
+        # The rules whose values are always thrown away by the rules that
+        # call them (e.g., because they're only used in the middle of
+        # sequences, or in lookaheads).
+        self.values_unused = set()
+
+        # Maps rules to the 'memo' or 'nomemo' annotations given for them
+        # in the grammar, if any.
+        self.memo_annotations = dict((n[1], n[3]) for n in ast[1]
+                                     if len(n) > 3 and isinstance(n[3], str))
+
+        # Maps rules to the expressions given in 'split' annotations for
+        # them, which match the places where the input may be split up in
+        # order to parse the pieces in parallel (see Compiler._split()).
+        self.split_annotations = dict((n[1], n[3][1]) for n in ast[1]
+                                      if len(n) > 3 and isinstance(n[3], list))
+
+        # The rules that only match tokens and don't build any values, and
+        # so are cheap to re-run.
+        self.cheap_rules = set()
+
+        # The rules that can apply themselves at the position they start
+        # at, directly or through other rules, and so would recurse forever
+        # if they were matched normally. Every cycle of such applies goes
+        # through at least one of the `leaders`, which are matched by
+        # growing a result from a failed seed (see
+        # Analyzer.compute_left_recursion()).
+        self.left_recursive = set()
+        self.leaders = set()
+
+        # The rules whose results are worth memoizing (see
+        # Analyzer.compute_memoized()).
+        self.memoized = set()
+
+    def first_of(self, node):
+        """Returns a (chars, nullable) tuple for the given node.
+
+        `chars` is a frozenset of the characters that a non-empty match
+        of the node can start with, or None if that can't be determined.
+        `nullable` is whether the node can match without consuming any
+        input.
+        """
+        typ = node[0]
+        if typ == 'lit':
+            if not node[1]:
+                return frozenset(), True
+            return frozenset(node[1][0]), False
+        if typ == 'range':
+            lo, hi = ord(node[1][1]), ord(node[2][1])
+            if hi - lo >= _MAX_RANGE_LEN:
+                return None, False
+            return frozenset(chr(i) for i in range(lo, hi + 1)), False
+        if typ == 'apply':
+            if node[1] in self.first:
+                return self.first[node[1]], self.nullable[node[1]]
+            if node[1] == 'anything':
+                return None, False
+            if node[1] == 'end':
+                return frozenset(), True
+            return None, True
+        if typ in ('label', 'paren'):
+            return self.first_of(node[1])
+        if typ == 'post':
+            chars, nullable = self.first_of(node[1])
+            return chars, nullable or node[2] != '+'
+        if typ == 'choice':
+            chars, nullable = frozenset(), False
+            for n in node[1]:
+                sub_chars, sub_nullable = self.first_of(n)
+                chars = _union(chars, sub_chars)
+                nullable = nullable or sub_nullable
+            return chars, nullable
+        if typ == 'seq':
+            chars = frozenset()
+            for n in node[1]:
+                sub_chars, sub_nullable = self.first_of(n)
+                chars = _union(chars, sub_chars)
+                if not sub_nullable:
+                    return chars, False
+            return chars, True
+
+        # 'action', 'empty', 'not', and 'pred' never consume anything.
+        return frozenset(), True
+
+
+    def char_class(self, node):
+        """Returns the characters matched by `node` as a sorted list of
+        non-overlapping (lo, hi) ranges of code points, if the node is a
+        choice of single-character literals and ranges (or a rule that is
+        one); otherwise returns None.
+
+        Such nodes always produce the character they match as their value,
+        so they can be replaced by a single test against the set."""
+        typ = node[0]
+        if typ == 'lit':
+            if len(node[1]) != 1:
+                return None
+            return [(ord(node[1]), ord(node[1]))]
+        if typ == 'range':
+            lo, hi = ord(node[1][1]), ord(node[2][1])
+            return [(lo, hi)] if lo <= hi else []
+        if typ == 'apply':
+            return self.char_classes.get(node[1])
+        if typ == 'paren':
+            return self.char_class(node[1])
+        if typ != 'choice':
+            return None
+
+        ranges = []
+        for n in node[1]:
+            sub_ranges = self.char_class(n)
+            if sub_ranges is None:
+                return None
+            ranges.extend(sub_ranges)
+        merged = []
+        for lo, hi in sorted(ranges):
+            if merged and lo <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(hi, merged[-1][1]))
+            else:
+                merged.append((lo, hi))
+        return merged
+
+
+def _union(s1, s2):
+    if s1 is None or s2 is None:
+        return None
+    return s1 | s2
+
+
+def _seq(nodes):
+    if not nodes:
+        return ['empty']
+    if len(nodes) == 1:
+        return nodes[0]
+    return ['seq', nodes]
+
+
+def _choice(nodes):
+    if len(nodes) == 1:
+        return nodes[0]
+    return ['choice', nodes]
+
+
+def _head(node):
+    # The first element of an alternative, if it could be combined with
+    # the first elements of others (see Analyzer.factor_choices()).
+    n = node[1][0] if node[0] == 'seq' else node
+    n = _unlabeled(n)
+    if n[0] in ('action', 'cut', 'empty', 'pred'):
+        return None
+    return n
+
+
+def _unlabeled(node):
+    if node[0] == 'label':
+        return node[1]
+    return node
+
+
+def _renamed(node, old, new):
+    # Returns a copy of the node with the label or variable `old` renamed.
+    if node and node[0] == 'label' and node[2] == old:
+        return ['label', _renamed(node[1], old, new), new]
+    if node and node[0] == 'll_var' and node[1] == old:
+        return ['ll_var', new]
+    return [_renamed(n, old, new) if isinstance(n, list) else n
+            for n in node]
+
+
+def _has_cut(node):
+    if node and node[0] == 'cut':
+        return True
+    return any(isinstance(n, list) and _has_cut(n) for n in node)
+
+
+def _labels(node):
+    names = set([node[2]]) if node and node[0] == 'label' else set()
+    for n in node:
+        if isinstance(n, list):
+            names |= _labels(n)
+    return names
+
+
+def _vars(node):
+    if node and node[0] == 'll_var':
+        return set([node[1]])
+    names = set()
+    for n in node:
+        if isinstance(n, list):
+            names |= _vars(n)
+    return names
+
+
+def _names(nodes):
+    # The labels and variables used anywhere in the given nodes.
+    names = set()
+    for n in nodes:
+        names |= _labels(n) | _vars(n)
+    return names
+
+
+def _free_vars(nodes):
+    # The variables used in the given alternatives that might not be
+    # labeled earlier in the same alternative.
+    names = set()
+    for node in nodes:
+        if node and node[0] == 'seq':
+            bound = set()
+            for n in node[1]:
+                names |= _free_vars([n]) - bound
+                if n[0] == 'label':
+                    bound.add(n[2])
+        elif node and node[0] == 'label':
+            names |= _free_vars([node[1]])
+        else:
+            names |= _vars(node)
+    return names
+
 
 class Analyzer(object):
     def __init__(self):
@@ -33,18 +270,434 @@ class Analyzer(object):
         if err:
             return None, err
         ast = self.rewrite_singles(ast)
-        return Grammar(ast), None
+        grammar = Grammar(ast)
+        self.compute_first_sets(grammar)
+        self.rewrite_right_recursive_lists(grammar)
+        self.factor_choices(grammar)
+        self.compute_char_classes(grammar)
+        self.compute_values_unused(grammar)
+        self.compute_left_recursion(grammar)
+        self.compute_memoized(grammar)
+        return grammar, None
 
     def _check_ast_is_a_list_of_rules(self, ast):
         if ast[0] != 'rules' or any(n[0] != 'rule' for n in ast[1]):
             return None, 'malformed ast'
         return ast, None
 
+    def compute_first_sets(self, grammar):
+        # The sets are computed as a least fixed point so that recursive
+        # rules are handled: start by assuming that every rule matches
+        # nothing and keep growing the sets until nothing changes.
+        grammar.first = {rule: frozenset() for rule in grammar.rules}
+        grammar.nullable = {rule: False for rule in grammar.rules}
+        changed = True
+        while changed:
+            changed = False
+            for rule, node in grammar.rules.items():
+                chars, nullable = grammar.first_of(node)
+                if (chars != grammar.first[rule] or
+                        nullable != grammar.nullable[rule]):
+                    grammar.first[rule] = chars
+                    grammar.nullable[rule] = nullable
+                    changed = True
+
+    def rewrite_right_recursive_lists(self, grammar):
+        # Rules of the form
+        #
+        #     list = item sep list:xs -> [x] + xs
+        #          | item end_sep     -> [x]
+        #          | item             -> [x]
+        #
+        # (where `item`, `sep` and `end_sep` may be sequences, `x` is any
+        # expression of the labels in `item`, and there may be any number
+        # of alternatives like the second one) recurse once per item, match
+        # the item again in every alternative once the last one is reached,
+        # and copy the list for every item. They're rewritten into the
+        # equivalent
+        #
+        #     list = (item -> x):xs_0 (sep item -> x)*:xs (end_sep | )
+        #              -> [xs_0] + xs
+        #
+        # which matches each item once, in a loop. The rewritten rules
+        # match the same things, so the FIRST sets don't change.
+        for rule, node in grammar.rules.items():
+            new_node = self._rewritten_list(grammar, rule, node)
+            if new_node:
+                grammar.rules[rule] = new_node
+
+    def _rewritten_list(self, grammar, rule, node):
+        # Returns the rewritten node for the rule if it is a list (see
+        # rewrite_right_recursive_lists()), or None.
+        if node[0] != 'choice' or _has_cut(node):
+            return None
+        rec, bases = node[1][0], node[1][1:]
+        if rec[0] != 'seq' or len(rec[1]) < 3:
+            return None
+        tail, action = rec[1][-2:]
+        if (tail[0] != 'label' or tail[1] != ['apply', rule] or
+                action[0] != 'action' or action[1][0] != 'll_plus' or
+                action[1][1][0] != 'll_arr' or len(action[1][1][1]) != 1 or
+                action[1][2] != ['ll_var', tail[2]]):
+            return None
+        elts, xs, x = rec[1][:-2], tail[2], action[1][1][1][0]
+
+        # The item is an alternative that every alternative starts with.
+        # The ones after it can never be reached, since it always matches
+        # if they could.
+        if any(base[0] != 'seq' or
+               base[1][-1] != ['action', ['ll_arr', [x]]] for base in bases):
+            return None
+        ends = [base[1][:-1] for base in bases]
+        for i, item in enumerate(ends):
+            if all(e[:len(item)] == item for e in ends + [elts]):
+                break
+        else:
+            return None
+        ends = ends[:i + 1]
+        sep = elts[len(item):]
+
+        # Each item and separator has to consume something, or the loop
+        # could go on forever (and the rule would be left-recursive). And
+        # `x` is now computed before `sep` and `end_sep` are matched, so
+        # it can't refer to their labels.
+        if grammar.first_of(['seq', elts])[1]:
+            return None
+        later = _labels(['seq', sep]).union(*[_labels(['seq', e[len(item):]])
+                                              for e in ends])
+        if (xs in _labels(['seq', elts]) | later or
+                not _vars(x) <= _labels(['seq', item]) - later):
+            return None
+
+        first = xs + '_0'
+        while first in _labels(node):
+            first += '_'
+        new_elts = [['label', _seq(item + [['action', x]]), first],
+                    ['label', ['post', _seq(sep + item + [['action', x]]),
+                               '*'], xs]]
+        if len(ends) > 1:
+            new_elts.append(['choice', [_seq(e[len(item):]) for e in ends]])
+        new_elts.append(['action', ['ll_plus', ['ll_arr', [['ll_var', first]]],
+                                    ['ll_var', xs]]])
+        return ['seq', new_elts]
+
+    def factor_choices(self, grammar):
+        # Alternatives that start with the same things, like
+        #
+        #     'a' 'b':x c -> x
+        #   | 'a' 'b':y   -> [y]
+        #
+        # are rewritten so that those things are only matched once:
+        #
+        #     'a' 'b':x (c -> x | -> [x])
+        #
+        # Only consecutive alternatives are combined, since the order of
+        # the alternatives matters, and the common elements can't include
+        # actions or predicates. The elements may have different labels
+        # (or none), in which case they're all given the same one, as
+        # long as neither name is used elsewhere in the rule.
+        for rule, node in grammar.rules.items():
+            grammar.rules[rule] = self._factored(node, set())
+
+    def _factored(self, node, outside):
+        # `outside` is the set of names used in the rule outside the node.
+        typ = node[0]
+        if typ == 'seq':
+            return [typ, [self._factored(n, outside |
+                                         _names(node[1][:i] +
+                                                node[1][i + 1:]))
+                          for i, n in enumerate(node[1])]]
+        if typ == 'label':
+            return [typ, self._factored(node[1], outside | set([node[2]])),
+                    node[2]]
+        if typ == 'post':
+            return [typ, self._factored(node[1], outside), node[2]]
+        if typ in ('not', 'paren'):
+            return [typ, self._factored(node[1], outside)]
+        if typ != 'choice':
+            return node
+
+        # Alternatives only see each other's labels through variables
+        # they use before labeling them themselves.
+        alts = [self._factored(n, outside |
+                               _free_vars(node[1][:i] + node[1][i + 1:]))
+                for i, n in enumerate(node[1])]
+        new_alts = []
+        i = 0
+        while i < len(alts):
+            j = i + 1
+            head = _head(alts[i])
+            while j < len(alts) and head and _head(alts[j]) == head:
+                j += 1
+            new_alt = None
+            if j - i > 1:
+                new_alt = self._factored_alts(
+                    alts[i:j], outside | _free_vars(alts[:i] + alts[j:]))
+            if new_alt:
+                new_alts.append(new_alt)
+            else:
+                new_alts.extend(alts[i:j])
+            i = j
+        return _choice(new_alts)
+
+    def _factored_alts(self, alts, outside):
+        # Returns a seq of the elements that all of the alternatives start
+        # with followed by a choice of the rest of them, or None if they
+        # can't be combined. `outside` is the set of names used in the
+        # rule outside of the alternatives.
+        if any(_has_cut(alt) for alt in alts):
+            return None
+        seqs = [list(alt[1]) if alt[0] == 'seq' else [alt] for alt in alts]
+        n = 0
+        while (all(len(s) > n for s in seqs) and
+               seqs[0][n][0] not in ('action', 'pred') and
+               all(_unlabeled(s[n]) == _unlabeled(seqs[0][n])
+                   for s in seqs)):
+            names = [s[n][2] for s in seqs if s[n][0] == 'label']
+            if names and not self._relabel(seqs, n, names[0], outside):
+                break
+            n += 1
+
+        # An alternative that is nothing but the common elements produces
+        # the value of the last one, which has to be labeled to get it.
+        while n and any(len(s) == n for s in seqs) and (
+                seqs[0][n - 1][0] != 'label'):
+            n -= 1
+        if not n:
+            return None
+        rests = [s[n:] or [['action', ['ll_var', seqs[0][n - 1][2]]]]
+                 for s in seqs]
+
+        # The labels in the rest of the alternatives are no longer in
+        # separate scopes, so one mustn't refer to the labels of another.
+        for i, rest in enumerate(rests):
+            bound = set().union(*[_labels(['seq', r]) for r in rests[:i]])
+            if (_vars(['seq', rest]) & bound) - _labels(['seq', rest]):
+                return None
+        return ['seq', seqs[0][:n] +
+                [self._factored(['choice', [_seq(r) for r in rests]],
+                                outside | _names(seqs[0][:n]))]]
+
+    def _relabel(self, seqs, n, name, outside):
+        # Gives the nth element of each seq the given label, renaming the
+        # label it had (if any) in the rest of the seq. Returns False
+        # (and leaves the seqs alone) if that would change what they mean,
+        # including when either name is used outside of the seqs.
+        for s in seqs:
+            if s[n][0] == 'label' and s[n][2] == name:
+                continue
+            old = s[n][2] if s[n][0] == 'label' else None
+            if (name in outside or old in outside or
+                    name in _labels(['seq', s]) | _vars(['seq', s]) or
+                    old in _labels(['seq', s[:n]]) | _vars(['seq', s[:n]])):
+                return False
+        for s in seqs:
+            if s[n][0] != 'label':
+                s[n] = ['label', s[n], name]
+            elif s[n][2] != name:
+                s[n:] = _renamed(s[n:], s[n][2], name)
+        return True
+
+    def compute_char_classes(self, grammar):
+        # A rule is a character class if everything it refers to is, so
+        # keep going until no more rules are found to be classes; rules that
+        # are (mutually) recursive never will be.
+        grammar.char_classes = {}
+        changed = True
+        while changed:
+            changed = False
+            for rule, node in grammar.rules.items():
+                if rule in grammar.char_classes:
+                    continue
+                ranges = grammar.char_class(node)
+                if ranges is not None:
+                    grammar.char_classes[rule] = ranges
+                    changed = True
+
+    def compute_values_unused(self, grammar):
+        used = set([grammar.starting_rule])
+        pending = [grammar.starting_rule]
+        while pending:
+            rule = pending.pop()
+            for name in self._applies_with_used_values(grammar.rules[rule],
+                                                       True):
+                if name in grammar.rules and name not in used:
+                    used.add(name)
+                    pending.append(name)
+        grammar.values_unused = set(grammar.rules) - used
+
+    def _applies_with_used_values(self, node, value_used):
+        typ = node[0]
+        if typ == 'apply':
+            if value_used:
+                yield node[1]
+        elif typ == 'seq':
+            last = len(node[1]) - 1
+            for i, n in enumerate(node[1]):
+                yield from self._applies_with_used_values(
+                    n, n[0] == 'label' or (i == last and value_used))
+        elif typ == 'choice':
+            for n in node[1]:
+                yield from self._applies_with_used_values(n, value_used)
+        elif typ in ('label', 'paren', 'post'):
+            yield from self._applies_with_used_values(
+                node[1], value_used or typ == 'label')
+        elif typ == 'not':
+            yield from self._applies_with_used_values(node[1], False)
+
+    def compute_left_recursion(self, grammar):
+        # A leader is matched by first storing a failure for it in the memo
+        # cache and then matching it over and over, storing each result, for
+        # as long as the results get longer; the applies of the leader at
+        # the same position see the previous result rather than recursing
+        # (this is the seed growing of Warth et al.). The other rules in a
+        # cycle have to be matched again each time around, since their
+        # results change as the seed grows, so they're never memoized.
+        #
+        # The leaders are picked in the order the rules are given: a rule
+        # that can still be reached from itself without going through any
+        # of the leaders picked so far becomes one.
+        calls = {}
+        for rule, node in grammar.rules.items():
+            names = set()
+            self._leading_applies(grammar, node, set(), False, names)
+            calls[rule] = names & set(grammar.rules)
+        grammar.left_recursive = set(
+            rule for rule in grammar.rules
+            if self._reaches(calls, rule, rule, set()))
+        grammar.leaders = set()
+        for rule in grammar.rules:
+            if (rule in grammar.left_recursive and
+                    self._reaches(calls, rule, rule, grammar.leaders)):
+                grammar.leaders.add(rule)
+
+    def _reaches(self, calls, start, target, leaders):
+        # Returns whether `target` can be applied at the position `start`
+        # starts at, without going through any of the leaders.
+        seen = set()
+        pending = [start]
+        while pending:
+            for name in calls[pending.pop()]:
+                if name == target:
+                    return True
+                if name not in seen and name not in leaders:
+                    seen.add(name)
+                    pending.append(name)
+        return False
+
+    def compute_memoized(self, grammar):
+        # Memoizing a rule only pays off if the rule can be called more
+        # than once at the same position, which happens when it can start
+        # more than one alternative of a choice (or more than one element of
+        # a sequence, as with `~foo foo` or `foo* foo`). The rules applied
+        # directly by the choices and sequences are found first; then any
+        # rules that can be reached at the start of those rules through
+        # other rules are found as well, stopping at the memoized ones
+        # since those won't be re-run.
+        #
+        # Rules that are cheap to re-run (i.e., that only match tokens and
+        # don't build any values) are never worth it. Left-recursive rules
+        # are memoized if and only if they're leaders, whatever the
+        # annotations say (see compute_left_recursion()).
+        cheap = self._cheap_rules(grammar)
+        grammar.cheap_rules = cheap
+        memoized = set()
+        for expand in (False, True):
+            for node in grammar.rules.values():
+                for name in self._rules_called_twice(grammar, node, memoized,
+                                                     expand):
+                    if name in grammar.rules and name not in cheap:
+                        memoized.add(name)
+        for rule, annotation in grammar.memo_annotations.items():
+            if annotation == 'memo':
+                memoized.add(rule)
+            else:
+                memoized.discard(rule)
+        memoized -= grammar.left_recursive
+        grammar.memoized = memoized | grammar.leaders
+
+    def _cheap_rules(self, grammar):
+        cheap = set()
+        changed = True
+        while changed:
+            changed = False
+            for rule, node in grammar.rules.items():
+                if rule not in cheap and self._is_cheap(node, cheap):
+                    cheap.add(rule)
+                    changed = True
+        return cheap
+
+    def _is_cheap(self, node, cheap):
+        typ = node[0]
+        if typ in ('lit', 'range', 'empty'):
+            return True
+        if typ == 'apply':
+            return node[1] in cheap or node[1] in ('anything', 'end')
+        if typ in ('choice', 'seq'):
+            return all(self._is_cheap(n, cheap) for n in node[1])
+        if typ in ('not', 'paren', 'post'):
+            return self._is_cheap(node[1], cheap)
+        return False
+
+    def _rules_called_twice(self, grammar, node, memoized, expand):
+        typ = node[0]
+        if typ in ('choice', 'seq'):
+            if typ == 'choice':
+                starts = node[1]
+            else:
+                # Only the elements up to the first one that must consume
+                # something start at the same position.
+                starts = []
+                for n in node[1]:
+                    starts.append(n)
+                    if not grammar.first_of(n)[1]:
+                        break
+            seen = set()
+            for n in starts:
+                names = set()
+                self._leading_applies(grammar, n, memoized, expand, names)
+                for name in names & seen:
+                    yield name
+                seen |= names
+            for n in node[1]:
+                yield from self._rules_called_twice(grammar, n, memoized,
+                                                    expand)
+        elif typ in ('label', 'not', 'paren', 'post'):
+            yield from self._rules_called_twice(grammar, node[1], memoized,
+                                                expand)
+
+    def _leading_applies(self, grammar, node, memoized, expand, names):
+        # Adds the rules that can be applied at the position the node
+        # starts at to `names`.
+        typ = node[0]
+        if typ == 'apply':
+            name = node[1]
+            if name in names:
+                return
+            names.add(name)
+            if expand and name in grammar.rules and name not in memoized:
+                self._leading_applies(grammar, grammar.rules[name], memoized,
+                                      expand, names)
+        elif typ == 'choice':
+            for n in node[1]:
+                self._leading_applies(grammar, n, memoized, expand, names)
+        elif typ == 'seq':
+            for n in node[1]:
+                self._leading_applies(grammar, n, memoized, expand, names)
+                if not grammar.first_of(n)[1]:
+                    break
+        elif typ in ('label', 'not', 'paren', 'post'):
+            self._leading_applies(grammar, node[1], memoized, expand, names)
+
     def rewrite_singles(self, node):
         if node[0] == 'rules':
             return [node[0], [self.rewrite_singles(n) for n in node[1]]]
         elif node[0] == 'rule':
-            return [node[0], node[1], self.rewrite_singles(node[2])]
+            return ([node[0], node[1], self.rewrite_singles(node[2])] +
+                    [n if isinstance(n, str) else self.rewrite_singles(n)
+                     for n in node[3:]])
+        elif node[0] == 'split':
+            return [node[0], self.rewrite_singles(node[1])]
         elif node[0] in ('choice', 'seq'):
             if len(node[1]) == 1:
                 return self.rewrite_singles(node[1][0])
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
 import shlex
 import sys
 import textwrap
@@ -26,11 +27,9 @@ _DEFAULT_HEADER = '''\
 #   https://github.com/dpranke/glop
 #   `glop %s`
 
-# pylint: disable=line-too-long,too-many-lines
-# pylint: disable=unnecessary-lambda,unnecessary-direct-lambda-call
+# pylint: disable=line-too-long,too-many-lines,too-many-return-statements
 
-import unicodedata
-'''
+%s'''
 
 
 _DEFAULT_FOOTER = ''
@@ -46,17 +45,15 @@ import argparse
 import json
 import os
 import sys
-import unicodedata
-
-# pylint: disable=line-too-long,too-many-lines
-# pylint: disable=unecessary-lambda,unnecessary-direct-lambda-call
+%s
+# pylint: disable=line-too-long,too-many-lines,too-many-return-statements
 
 def main(argv=sys.argv[1:], stdin=sys.stdin, stdout=sys.stdout,
          stderr=sys.stderr, exists=os.path.exists, opener=open):
     arg_parser = argparse.ArgumentParser()
-    arg_parser.add_argument('-D', '--define', action='append',
+    arg_parser.add_argument('-D', '--define', action='append', default=[],
                             help='Define a global var=value')
-    arg_parser.add_argument('file', nargs='?')
+%s    arg_parser.add_argument('file', nargs='?')
     args = arg_parser.parse_args(argv)
 
     globals={}
@@ -74,16 +71,54 @@ def main(argv=sys.argv[1:], stdin=sys.stdin, stdout=sys.stdout,
         fname = args.file
         fp = opener(fname)
 
-    msg = fp.read()
-    obj, err, _ = %s(msg, fname).parse(globals)
+%s    obj, err, _ = %s(msg, fname).parse(globals)
     if err:
         print(err, file=stderr)
         return 1
-    print(json.dumps(obj), file=stdout)
+    print(json.dumps(obj%s), file=stdout)
     return 0
 '''
 
 
+_MAIN_READ = '''\
+    msg = fp.read()
+'''
+
+
+_MMAP_MAIN_ARGS = '''\
+    arg_parser.add_argument('--mmap', action='store_true',
+                            help='map the file into memory rather than '
+                                 'reading it')
+'''
+
+
+# Empty files can't be mapped, so those are just read.
+_STREAM_MAIN_READ = '''\
+    if args.mmap and fp is not stdin and os.path.getsize(fname):
+        fp.close()
+        fp = opener(fname, 'rb')
+        msg = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        msg = fp
+'''
+
+
+_BYTES_MAIN_READ = '''\
+    if fp is stdin:
+        msg = stdin.buffer.read()
+    else:
+        fp.close()
+        fp = opener(fname, 'rb')
+        if args.mmap and os.path.getsize(fname):
+            msg = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            msg = fp.read()
+'''
+
+
+_BYTES_DUMPS_ARGS = ", default=lambda b: b.decode('utf-8', 'backslashreplace')"
+
+
 _MAIN_FOOTER = '''\
 
 
@@ -96,16 +131,16 @@ _PUBLIC_METHODS = """\
 
 
 class %s:
+    _memo_rules = (%s)
+%s
     def __init__(self, msg, fname):
-        self.msg = msg
-        self.end = len(self.msg)
-        self.fname = fname
+%s        self.fname = fname
         self.val = None
         self.pos = 0
         self.failed = False
         self.errpos = 0
         self._scopes = []
-        self._cache = {}
+%s        self._evictions = [0 for _ in self._memo_rules]
         self._global_vars = {}
 
     def parse(self, global_vars=None):
@@ -114,29 +149,202 @@ class %s:
         if self.failed:
             return None, self._err_str(), self.errpos
         return self.val, None, self.pos
+%s
+    def memo_evictions(self):
+        return dict(zip(self._memo_rules, self._evictions))
+"""
+
+_INPUT_INIT = """\
+        self.msg = msg
+        self.end = len(self.msg)
+        self._newlines = []
+        self._newlines_end = 0
+"""
+
+_STREAM_INPUT_INIT = """\
+        if isinstance(msg, (str, bytes)):
+            chunks = [msg]
+        elif hasattr(msg, 'read'):
+            chunks = iter(lambda: msg.read(65536), msg.read(0))
+        else:
+            chunks = msg
+        self._chunks = self._decode(chunks)
+        self.msg = ''
+        self.end = 0
+        self._base = 0
+        self._eof = False
+        self._lineno = 1
+        self._colno = 1
+"""
+
+_SPLIT_INIT = """\
+        self._presplit = {}
+"""
+
+_SPLIT_METHODS = """\
+
+    def split_points(self, n):
+        # Finds up to n - 1 places to split the input at, spread out
+        # evenly, each just after a match of the 'split' annotation.
+        points = []
+        for i in range(1, n):
+            m = _SPLIT.search(self.msg, self.end * i // n)
+            if not m or m.end() >= self.end:
+                break
+            if m.end() > (points[-1] if points else 0):
+                points.append(m.end())
+        return points
+
+    def parse_items(self, start, stop, global_vars=None):
+        # Matches items of the split repetition from `start` until one
+        # ends at or after `stop` (or one fails), and returns them along
+        # with where they ended and the furthest error position.
+        self._global_vars = global_vars or {}
+        self.pos = start
+        vs = []
+%s        while self.pos < stop:
+            p = self.pos
+%s            if self.failed:
+                self._rewind(p)
+                break
+            vs.append(self.val)
+%s        return vs, self.pos, self.errpos
+
+    def parse_with_items(self, items, global_vars=None):
+        # Like parse(), but `items` maps positions to the results of calls
+        # to parse_items() starting there, which are used instead of
+        # matching those items again if the repetition gets to them.
+        self._presplit = items
+        return self.parse(global_vars)
+"""
+
+_MEMO_INIT = """\
+        self._cache = [{} for _ in self._memo_rules]
+"""
+
+# With a memo limit, the caches are kept in the order the results were
+# stored in, so that the oldest ones can be evicted cheaply. The seeds of
+# left-recursive rules that are still being grown are never evicted (see
+# Compiler._method_text()), so they're kept track of as well.
+_LIMITED_MEMO_INIT = """\
+        self._cache = [collections.OrderedDict() for _ in self._memo_rules]
+        self._growing = set()
+"""
+
+_PROFILE_INIT = """\
+        self._profile = [[0, 0.0, 0.0, 0, 0] for _ in self._rules]
+        self._child_time = 0.0
+"""
+
+_PROFILE_METHODS = """\
+
+    def profile(self):
+        # For each rule, returns the number of times it was called, the
+        # time spent in it (with and without the rules it called), how
+        # many of the calls failed (making the caller backtrack), and, for
+        # memoized rules, how many were answered from the cache.
+        stats = {}
+        for rule, (calls, total, own, fails, misses) in zip(
+                self._rules, self._profile):
+            stats[rule] = {'calls': calls, 'time': total, 'self_time': own,
+                           'backtracks': fails}
+            if rule in self._memo_rules:
+                stats[rule]['memo_hits'] = calls - misses
+                stats[rule]['memo_misses'] = misses
+        return stats
+"""
+
+_HEATMAP_INIT = """\
+        self._attempts = {}
+        self._stacks = {}
+        self._stack = []
+"""
+
+_HEATMAP_METHODS = """\
+
+    def heatmap(self, n=10):
+        # Returns the number of times the rules were matched (rather than
+        # found in the memo cache) per character of input, and the n rules
+        # and positions that were matched the most times, along with the
+        # rules being matched when each position was first matched again.
+        spots = []
+        for key, count in heapq.nlargest(n, self._attempts.items(),
+                                         key=lambda item: item[1]):
+            pos, i = divmod(key, len(self._rules))
+            lineno, colno = self.pos_to_line_col(pos)
+            spots.append({'rule': self._rules[i], 'line': lineno,
+                          'column': colno, 'count': count,
+                          'stack': [self._rules[j]
+                                    for j in self._stacks.get(key, ())]})
+        return {'attempts_per_char': (sum(self._attempts.values()) /
+                                      max(self.end, 1)),
+                'hotspots': spots}
+"""
+
+_MEMO_STATS = """\
+
+    def memo_stats(self):
+        return dict(zip(self._memo_rules, map(len, self._cache)))
+"""
+
+_INCREMENTAL_MEMO_INIT = """\
+        self._cache = [None] * (self.end + 1)
+        self._examined = 0
+        self._max_span = 0
+"""
+
+_INCREMENTAL_MEMO_STATS = """\
+
+    def memo_stats(self):
+        counts = [0 for _ in self._memo_rules]
+        for column in self._cache:
+            for i in column or ():
+                counts[i] += 1
+        return dict(zip(self._memo_rules, counts))
+
+    def reparse(self, start, end, text, global_vars=None):
+        self.msg = self.msg[:start] + text + self.msg[end:]
+        self.end = len(self.msg)
+        del self._newlines[bisect.bisect_left(self._newlines, start):]
+        self._newlines_end = min(self._newlines_end, start)
+        cache = self._cache
+        cache[start:end] = [None] * len(text)
+        for p in range(max(start - self._max_span, 0), start):
+            column = cache[p]
+            if column:
+                for i, (_, _, _, examined) in list(column.items()):
+                    if p + examined >= start:
+                        del column[i]
+        self.val = None
+        self.pos = 0
+        self.failed = False
+        self.errpos = 0
+        self._examined = 0
+        return self.parse(global_vars)
 """
 
 _HELPER_METHODS = """\
 
+    def pos_to_line_col(self, pos):
+        # The offsets of the newlines in the input are only found as far as
+        # they're needed, and then looked up with a binary search.
+        newlines = self._newlines
+        if pos > self._newlines_end:
+            newlines.extend(m.start() for m in
+                            _NEWLINE.finditer(self.msg, self._newlines_end,
+                                              pos))
+            self._newlines_end = pos
+        i = bisect.bisect_left(newlines, pos)
+        return i + 1, pos - (newlines[i - 1] if i else -1)
+
     def _err_str(self):
-        lineno, colno = self._err_offsets()
+        lineno, colno = self.pos_to_line_col(self.errpos)
         if self.errpos == len(self.msg):
             thing = 'end of input'
         else:
             thing = f'"{self.msg[self.errpos]}"'
         return f'{self.fname}:{lineno} Unexpected {thing} at column {colno}'
 
-    def _err_offsets(self):
-        lineno = 1
-        colno = 1
-        for i in range(self.errpos):
-            if self.msg[i] == '\\n':
-                lineno += 1
-                colno = 1
-            else:
-                colno += 1
-        return lineno, colno
-
     def _succeed(self, v, newpos=None):
         self.val = v
         self.failed = False
@@ -150,91 +358,209 @@ _HELPER_METHODS = """\
 
     def _rewind(self, newpos):
         self._succeed(None, newpos)
+"""
+
+# When matching bytes, the characters in the grammar stand for the bytes
+# with the same values, and each byte matched produces a one-byte bytes
+# object (from the _BYTES table, so they don't have to be allocated).
+_BYTES_HELPER_METHODS = _HELPER_METHODS.replace(
+    'thing = f\'"{self.msg[self.errpos]}"\'',
+    'thing = f\'"{chr(self.msg[self.errpos])}"\'')
 
-    def _bind(self, rule, var):
-        rule()
-        if not self.failed:
-            self._set(var, self.val)
+_EXPECT = """\
 
-    def _not(self, rule):
+    def _ch(self, ch):
         p = self.pos
-        errpos = self.errpos
-        rule()
-        if self.failed:
-            self._succeed(None, p)
+        if p < self.end and self.msg[p] == ch:
+            self._succeed(ch, self.pos + 1)
         else:
-            self._rewind(p)
-            self.errpos = errpos
             self._fail()
 
-    def _opt(self, rule):
+    def _str(self, s):
         p = self.pos
-        rule()
-        if self.failed:
-            self._succeed([], p)
+        if self.msg.startswith(s, p):
+            self.val = s
+            self.failed = False
+            self.pos = p + len(s)
+            return
+
+        # Report the failure at the first character that didn't match.
+        i = 0
+        while p + i < self.end and self.msg[p + i] == s[i]:
+            i += 1
+        self.pos = p + i
+        self._fail()
+"""
+
+_BYTES_EXPECT = """\
+
+    def _ch(self, ch):
+        p = self.pos
+        if p < self.end and self.msg[p] == ch:
+            self._succeed(_BYTES[ch], self.pos + 1)
         else:
-            self._succeed([self.val])
+            self._fail()
 
-    def _plus(self, rule):
-        vs = []
-        rule()
-        vs.append(self.val)
-        if self.failed:
+    def _str(self, s):
+        p = self.pos
+        if self.msg[p:p + len(s)] == s:
+            self.val = s
+            self.failed = False
+            self.pos = p + len(s)
             return
-        self._star(rule, vs)
 
-    def _star(self, rule, vs=None):
-        vs = vs or []
-        while True:
-            p = self.pos
-            rule()
-            if self.failed:
-                self._rewind(p)
-                break
-            vs.append(self.val)
-        self._succeed(vs)
+        # Report the failure at the first byte that didn't match.
+        i = 0
+        while p + i < self.end and self.msg[p + i] == s[i]:
+            i += 1
+        self.pos = p + i
+        self._fail()
+"""
 
-    def _seq(self, rules):
-        for rule in rules:
-            rule()
-            if self.failed:
-                return
+_STRS = """\
 
-    def _choose(self, rules):
+    def _strs(self, table):
         p = self.pos
-        for rule in rules[:-1]:
-            rule()
+        entry = table.get(self.msg[p]) if p < self.end else None
+        if entry is None:
+            self._fail()
+            return
+        skipped_first, strs = entry
+        if skipped_first and self.errpos < p:
+            self.errpos = p
+        for s in strs:
+            self._str(s)
             if not self.failed:
                 return
-            self._rewind(p)
-        rules[-1]()
+            self.pos = p
 """
 
-_EXPECT = """\
+_STREAM_HELPER_METHODS = """\
+
+    def _decode(self, chunks):
+        # Decodes any chunks of bytes (e.g., from a binary file or an
+        # mmap) as UTF-8 as they're read.
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in chunks:
+            if not isinstance(chunk, str):
+                chunk = decoder.decode(chunk)
+            if chunk:
+                yield chunk
+        decoder.decode(b'', final=True)
+
+    def _more(self, p):
+        # Reads more of the input until position `p` is in the buffer (or
+        # the input runs out), returning whether it is. At least as much
+        # as is already buffered is read, so that the buffer only has to
+        # be copied a logarithmic number of times.
+        if self._eof:
+            return False
+        chunks = [self.msg]
+        n = len(self.msg)
+        want = max(p + 1 - self._base, 2 * n)
+        for chunk in self._chunks:
+            chunks.append(chunk)
+            n += len(chunk)
+            if n >= want:
+                break
+        else:
+            self._eof = True
+        self.msg = ''.join(chunks)
+        self.end = self._base + len(self.msg)
+        return p < self.end
+
+    def pos_to_line_col(self, pos):
+        # Only the positions that are still buffered (or haven't been read
+        # yet) can be looked up.
+        if pos < self._base:
+            raise ValueError(f'{pos} has already been discarded')
+        if pos >= self.end:
+            self._more(pos)
+        n = pos - self._base
+        newlines = self.msg.count('\\n', 0, n)
+        if newlines:
+            return self._lineno + newlines, n - self.msg.rfind('\\n', 0, n)
+        return self._lineno, self._colno + n
+
+    def _err_str(self):
+        lineno, colno = self.pos_to_line_col(self.errpos)
+        if self.errpos < self.end or self._more(self.errpos):
+            thing = f'"{self.msg[self.errpos - self._base]}"'
+        else:
+            thing = 'end of input'
+        return f'{self.fname}:{lineno} Unexpected {thing} at column {colno}'
+""" + _HELPER_METHODS[_HELPER_METHODS.index('\n    def _succeed'):]
+
+_STREAM_EXPECT = """\
 
     def _ch(self, ch):
         p = self.pos
-        if p < self.end and self.msg[p] == ch:
+        if ((p < self.end or self._more(p)) and
+                self.msg[p - self._base] == ch):
             self._succeed(ch, self.pos + 1)
         else:
             self._fail()
 
     def _str(self, s):
-        for ch in s:
-            self._ch(ch)
-            if self.failed:
-                return
-        self.val = s
+        p = self.pos
+        if p + len(s) > self.end:
+            self._more(p + len(s) - 1)
+        if self.msg.startswith(s, p - self._base):
+            self.val = s
+            self.failed = False
+            self.pos = p + len(s)
+            return
+
+        # Report the failure at the first character that didn't match.
+        i = 0
+        while p + i < self.end and self.msg[p + i - self._base] == s[i]:
+            i += 1
+        self.pos = p + i
+        self._fail()
 """
 
-_RANGE = """\
+_STREAM_STRS = """\
 
-    def _range(self, i, j):
+    def _strs(self, table):
         p = self.pos
-        if p != self.end and ord(i) <= ord(self.msg[p]) <= ord(j):
-            self._succeed(self.msg[p], self.pos + 1)
+        if p < self.end or self._more(p):
+            entry = table.get(self.msg[p - self._base])
         else:
+            entry = None
+        if entry is None:
             self._fail()
+            return
+        skipped_first, strs = entry
+        if skipped_first and self.errpos < p:
+            self.errpos = p
+        for s in strs:
+            self._str(s)
+            if not self.failed:
+                return
+            self.pos = p
+"""
+
+_DISCARD = """\
+
+    def _discard(self):
+        n = self.pos - self._base
+        if n < len(self.msg) // 2:
+            return
+        self._lineno, self._colno = self.pos_to_line_col(self.pos)
+        self.msg = self.msg[n:]
+        self._base = self.pos
+        self._commit()
+"""
+
+_COMMIT = """\
+
+    def _commit(self):
+        p = self.pos
+        for i, cache in enumerate(self._cache):
+            evicted = [k for k in cache if k < p%s]
+            for k in evicted:
+                del cache[k]
+            self._evictions[i] += len(evicted)
 """
 
 _BINDINGS = """\
@@ -256,6 +582,43 @@ _BINDINGS = """\
 """
 
 
+# How much of a node's code may be inlined into the code for its parent:
+# either a single line (usually a call to a method for the node), or any
+# block of code that doesn't return early.
+_INLINE_CALL = 0
+_INLINE_BLOCK = 1
+
+# Sets of characters bigger than this are emitted as module-level constants
+# rather than inline in the generated code.
+_MAX_INLINE_SET_LEN = 8
+
+
+# Character classes with more characters than this are matched with
+# regular expressions rather than sets.
+_MAX_CHAR_SET_LEN = 256
+
+
+def _tuple(strs):
+    """Returns the source for a tuple of the given strings."""
+    return (', '.join(string_literal.encode(s) for s in strs) +
+            (',' if len(strs) == 1 else ''))
+
+
+def _re_class(ranges, binary=False):
+    return '[%s]' % ''.join(_re_char(lo, binary) if lo == hi else
+                            '%s-%s' % (_re_char(lo, binary),
+                                       _re_char(hi, binary))
+                            for lo, hi in ranges)
+
+
+def _re_char(code_point, binary=False):
+    if binary:
+        return '\\x%02x' % code_point
+    if code_point > 0xffff:
+        return '\\U%08x' % code_point
+    return '\\u%04x' % code_point
+
+
 def d(s):
     return textwrap.dedent(s).splitlines()
 
@@ -292,6 +655,29 @@ _DEFAULT_FUNCTIONS = {
 }
 
 
+# The values produced by actions may still be strings (e.g., from non-ASCII
+# literals in the actions), so those are encoded as UTF-8 when they're
+# combined with bytes.
+_BYTES_FUNCTIONS = dict(_DEFAULT_FUNCTIONS, **{
+    'cat': d('''\
+        def _cat(self, strs):
+            return b''.join(s.encode('utf-8') if isinstance(s, str) else s
+                            for s in strs)
+        '''),
+    'is_unicat': d('''\
+        def _is_unicat(self, var, cat):
+            return unicodedata.category(chr(var[0])) == cat
+        '''),
+    'join': d('''\
+        def _join(self, s, vs):
+            if isinstance(s, str):
+                s = s.encode('utf-8')
+            return s.join(v.encode('utf-8') if isinstance(v, str) else v
+                          for v in vs)
+        '''),
+})
+
+
 _DEFAULT_IDENTIFIERS = {
     'null': 'None',
     'true': 'True',
@@ -299,6 +685,41 @@ _DEFAULT_IDENTIFIERS = {
 }
 
 
+_STREAM_RULES = {
+    'anything': d('''\
+        def _anything_(self):
+            p = self.pos
+            if p < self.end or self._more(p):
+                self._succeed(self.msg[p - self._base], p + 1)
+            else:
+                self._fail()
+    '''),
+    'end': d('''\
+        def _end_(self):
+            if self.pos == self.end and not self._more(self.pos):
+                self._succeed(None)
+            else:
+                self._fail()
+    '''),
+}
+
+_BYTES_RULES = {
+    'anything': d('''\
+        def _anything_(self):
+            if self.pos < self.end:
+                self._succeed(_BYTES[self.msg[self.pos]], self.pos + 1)
+            else:
+                self._fail()
+    '''),
+    'end': d('''\
+        def _end_(self):
+            if self.pos == self.end:
+                self._succeed(None)
+            else:
+                self._fail()
+    '''),
+}
+
 _DEFAULT_RULES = {
     'anything': d('''\
         def _anything_(self):
@@ -318,42 +739,187 @@ _DEFAULT_RULES = {
 
 
 class Compiler(object):
-    def __init__(self, grammar, classname, main_wanted, memoize=True):
+    def __init__(self, grammar, classname, main_wanted, memoize=True,
+                 memo_limit=None, incremental=False, streaming=False,
+                 binary=False, profile=False, heatmap=False):
         self.grammar = grammar
         self.classname = classname
         self.indent = 0
         args = shlex.join(sys.argv[1:])
         vers = version.VERSION
-        if main_wanted:
-            self.header = _MAIN_HEADER % (vers, args, self.classname)
+        modules = ['re', 'unicodedata']
+        modules.append('codecs' if streaming else 'bisect')
+        if main_wanted and (streaming or binary):
+            modules.append('mmap')
+        if profile:
+            modules.append('time')
+        if heatmap:
+            modules.append('heapq')
+        if memo_limit is not None:
+            modules.append('collections')
+        imports = ''.join('import %s\n' % m for m in sorted(modules))
+        if main_wanted and (streaming or binary):
+            if streaming:
+                main_read = _STREAM_MAIN_READ
+            else:
+                main_read = _BYTES_MAIN_READ
+            self.header = _MAIN_HEADER % (vers, args, imports,
+                                          _MMAP_MAIN_ARGS, main_read,
+                                          self.classname,
+                                          _BYTES_DUMPS_ARGS if binary else '')
+            self.footer = _MAIN_FOOTER
+        elif main_wanted:
+            self.header = _MAIN_HEADER % (vers, args, imports, '',
+                                          _MAIN_READ, self.classname, '')
             self.footer = _MAIN_FOOTER
         else:
-            self.header = _DEFAULT_HEADER % (vers, args)
+            self.header = _DEFAULT_HEADER % (vers, args, imports)
             self.footer = _DEFAULT_FOOTER
-        self.builtin_functions = _DEFAULT_FUNCTIONS
         self.builtin_identifiers = _DEFAULT_IDENTIFIERS
-        self.builtin_rules = _DEFAULT_RULES
+        if binary:
+            self.builtin_functions = _BYTES_FUNCTIONS
+            self.builtin_rules = _BYTES_RULES
+        elif streaming:
+            self.builtin_functions = _DEFAULT_FUNCTIONS
+            self.builtin_rules = _STREAM_RULES
+        else:
+            self.builtin_functions = _DEFAULT_FUNCTIONS
+            self.builtin_rules = _DEFAULT_RULES
         self.memoize = memoize
+        self.memo_limit = memo_limit
+        self.incremental = incremental
+        self.streaming = streaming
+        self.binary = binary
+        self.profile = profile
+        self.heatmap = heatmap
 
         self._builtin_functions_needed = set()
         self._builtin_rules_needed = set()
         self._bindings_needed = False
         self._expect_needed = False
-        self._range_needed = False
+        self._strs_needed = False
+        self._commit_needed = False
+        self._discard_needed = False
+        self._commit_nodes = set()
+        self._split_node = None
+        self._split_lines = []
         self._methods = {}
         self._method_lines = []
+        self._constants = {}
+        self._value_used = True
 
     def compile(self):
+        if self.incremental and self.memo_limit is not None:
+            return None, 'memo limits can not be used with incremental parsing'
+        if self.incremental and self.streaming:
+            return None, 'streaming can not be used with incremental parsing'
+        if self.binary and self.streaming:
+            return None, 'streaming can not be used with bytes input'
+        if self.heatmap and self.streaming:
+            return None, 'heatmaps can not be made when streaming'
+        if self.binary:
+            wide_lits = self._wide_lits(self.grammar.ast)
+            if wide_lits:
+                return None, '%s can not be matched as bytes' % (
+                    string_literal.encode(wide_lits[0]))
+            self._constant('_BYTES', '[bytes([i]) for i in range(256)]')
+        if not self.streaming:
+            self._constant('_NEWLINE', 're.compile(%s)' % self._str_expr('\n'))
+        err = self._split()
+        if err:
+            return None, err
+
+        if ((self.memoize and self.memo_limit is not None) or
+                (self.streaming and self._can_discard())):
+            self._find_commit_nodes()
+
         for rule, node in self.grammar.rules.items():
-            self._compile(node, rule, top_level=True)
+            self._compile(node, rule, top_level=True,
+                          value_used=rule not in self.grammar.values_unused)
+
+        # Each memoized rule has its own cache, indexed by its position in
+        # this list, mapping starting positions to results. Left-recursive
+        # rules are matched by growing their results in the cache, so the
+        # leaders always have one and the rest never do (see
+        # Analyzer.compute_left_recursion()).
+        leaders = self.grammar.leaders
+        if self.incremental:
+            # Anything that isn't cheap to re-run is memoized, so that as
+            # much as possible can be reused after an edit, except for the
+            # starting rule, since any edit will invalidate it.
+            annotations = self.grammar.memo_annotations
+            memo_rules = [rule for rule in self.grammar.rules
+                          if rule in leaders or
+                          rule not in self.grammar.left_recursive and (
+                              annotations.get(rule) == 'memo' or (
+                                  rule not in self.grammar.cheap_rules and
+                                  rule != self.grammar.starting_rule and
+                                  annotations.get(rule) != 'nomemo'))]
+        elif self.memoize:
+            memo_rules = [rule for rule in self.grammar.rules
+                          if rule in self.grammar.memoized]
+        else:
+            memo_rules = [rule for rule in self.grammar.rules
+                          if rule in leaders]
+        self._memo_indices = {rule: i for i, rule in enumerate(memo_rules)}
+
+        # The rules are numbered when they're instrumented, so that their
+        # stats can be kept in lists.
+        if self.profile or self.heatmap:
+            rules = list(self.grammar.rules)
+            self._rule_indices = {rule: i for i, rule in enumerate(rules)}
+            rule_names = '    _rules = (%s)\n' % _tuple(rules)
+        else:
+            rule_names = ''
 
         text = self.header + _PUBLIC_METHODS % (
-            self.classname, self.grammar.starting_rule) + _HELPER_METHODS
-
-        if self._expect_needed:
+            self.classname,
+            _tuple(memo_rules),
+            rule_names,
+            _STREAM_INPUT_INIT if self.streaming else
+            _INPUT_INIT + (_SPLIT_INIT if self._split_node else ''),
+            (_INCREMENTAL_MEMO_INIT if self.incremental else
+             _LIMITED_MEMO_INIT if self.memo_limit is not None else
+             _MEMO_INIT) +
+            (_PROFILE_INIT if self.profile else '') +
+            (_HEATMAP_INIT if self.heatmap else ''),
+            self.grammar.starting_rule,
+            _INCREMENTAL_MEMO_STATS if self.incremental else _MEMO_STATS)
+        if self.profile:
+            text += _PROFILE_METHODS
+        if self.heatmap:
+            text += _HEATMAP_METHODS
+        if self.streaming:
+            text += _STREAM_HELPER_METHODS
+        elif self.binary:
+            text += _BYTES_HELPER_METHODS
+        else:
+            text += _HELPER_METHODS
+        if self._split_node:
+            start = self.grammar.starting_rule
+            node = self.grammar.rules[start]
+            if node[0] == 'seq' and self._has_labels(node):
+                push, pop = ("        self._push('%s')\n" % start,
+                             "        self._pop('%s')\n" % start)
+            else:
+                push, pop = '', ''
+            text += _SPLIT_METHODS % (
+                push, ''.join('            %s\n' % line
+                              for line in self._split_lines), pop)
+
+        if self._expect_needed and self.streaming:
+            text += _STREAM_EXPECT
+        elif self._expect_needed and self.binary:
+            text += _BYTES_EXPECT
+        elif self._expect_needed:
             text += _EXPECT
-        if self._range_needed:
-            text += _RANGE
+        if self._strs_needed:
+            text += _STREAM_STRS if self.streaming else _STRS
+        if self._commit_needed:
+            text += _COMMIT % (' and (i, k) not in self._growing'
+                               if self.memo_limit is not None else '')
+        if self._discard_needed:
+            text += _DISCARD
         if self._bindings_needed:
             text += _BINDINGS
 
@@ -366,10 +932,10 @@ class Compiler(object):
         for rule in self.grammar.rules.keys():
             methods.add(rule)
             text += self._method_text(rule, self._methods[rule],
-                                      memoize=self.memoize)
+                                      memoize=rule in self._memo_indices)
 
-            # Do not memoize the internal rules; it's not clear if that'd
-            # ever be useful.
+            # The internal rules are never memoized, since they are only
+            # ever called from one place.
             names = [m for m in self._methods
                      if m.startswith(rule + '_') and m not in methods]
             for name in sorted(names):
@@ -382,63 +948,369 @@ class Compiler(object):
             for line in self.builtin_rules[name]:
                 text += '    %s\n' % line
 
+        if self._constants:
+            text += '\n\n'
+            for expr, name in self._constants.items():
+                text += '%s = %s\n' % (name, expr)
+
         text += self.footer
         return text, None
 
+    def _can_discard(self):
+        """Returns whether the text before each item of a top-level
+        repetition of the starting rule can be thrown away when streaming.
+
+        That's only true if nothing can backtrack past a completed item,
+        i.e., if the starting rule isn't a choice and isn't applied by
+        any rule."""
+        start = self.grammar.starting_rule
+        node = self.grammar.rules[start]
+        if node[0] == 'label':
+            node = node[1]
+        return node[0] != 'choice' and not any(
+            self._applies(n, start) for n in self.grammar.rules.values())
+
+    def _applies(self, node, rule):
+        if node and node[0] == 'apply':
+            return node[1] == rule
+        return any(isinstance(n, list) and self._applies(n, rule)
+                   for n in node)
+
+    def _wide_lits(self, node):
+        """Returns the literals (including the ends of ranges) with
+        characters that don't fit in a byte."""
+        if node and node[0] == 'lit':
+            return [node[1]] if any(ord(ch) > 255 for ch in node[1]) else []
+        return [s for n in node if isinstance(n, list)
+                for s in self._wide_lits(n)]
+
+    def _find_commit_nodes(self):
+        """Finds the repetitions at the top level of the starting rule.
+
+        Once an iteration of one of these has succeeded, the parser will
+        normally never go back to anything before it, so the memoized
+        results for those positions can be thrown away."""
+        for n in self._top_level_repetitions():
+            self._commit_nodes.add(id(n))
+
+    def _top_level_repetitions(self):
+        node = self.grammar.rules[self.grammar.starting_rule]
+        if node[0] == 'label':
+            node = node[1]
+        nodes = []
+        for n in node[1] if node[0] == 'seq' else [node]:
+            if n[0] == 'label':
+                n = n[1]
+            if n[0] == 'post' and n[2] in ('*', '+'):
+                nodes.append(n)
+        return nodes
+
+    def _split(self):
+        """Checks the 'split' annotation, if any, and finds the repetition
+        it applies to. Returns an error message if it can't be used.
+
+        The annotation marks the first top-level repetition of the
+        starting rule as one whose items can be matched separately, in
+        different processes, starting at the places where its expression
+        matches (see glop.interpreter.parse_in_parallel()). For that to
+        give the same results, the items can't refer to anything bound
+        outside of the repetition. Parsers that stream their input or
+        reparse it incrementally just ignore the annotation."""
+        start = self.grammar.starting_rule
+        for rule in self.grammar.split_annotations:
+            if rule != start:
+                return ('"%s" can not be split, since it is not the '
+                        'starting rule' % rule)
+        if start not in self.grammar.split_annotations:
+            return None
+        nodes = self._top_level_repetitions()
+        if not nodes:
+            return ('"%s" must have a top-level repetition to be split' %
+                    start)
+        pat = self._regexp(self.grammar.split_annotations[start], set())
+        if pat is None:
+            return ('the split annotation for "%s" can not be matched with '
+                    'a regexp' % start)
+        outer_labels = self._labels(self.grammar.rules[start], nodes[0])
+        refs = self._vars(nodes[0]) & outer_labels
+        if refs:
+            return ('the items of "%s" can not be split, since they refer '
+                    'to "%s"' % (start, sorted(refs)[0]))
+        if self.streaming or self.incremental:
+            return None
+        self._split_node = nodes[0]
+        self._constant('_SPLIT', 're.compile(%s, re.S)' %
+                       self._str_expr(pat[0]))
+        return None
+
+    def _labels(self, node, skip):
+        """Returns the names of the labels in `node`, outside of `skip`."""
+        if node is skip:
+            return set()
+        names = set([node[2]]) if node[0] == 'label' else set()
+        for n in node:
+            if isinstance(n, list):
+                names |= self._labels(n, skip)
+        return names
+
+    def _vars(self, node):
+        """Returns the names of the variables referred to in `node`."""
+        if node and node[0] == 'll_var':
+            return set([node[1]])
+        names = set()
+        for n in node:
+            if isinstance(n, list):
+                names |= self._vars(n)
+        return names
+
     def _method_text(self, name, lines, memoize):
         text = '\n'
-        text += '    def _%s_(self):\n' % name
-        if memoize:
-            text += '        r = self._cache.get(("%s", self.pos))\n' % name
-            text += '        if r is not None:\n'
-            text += '            self.val, self.failed, self.pos = r\n'
-            text += '            return\n'
-            text += '        pos = self.pos\n'
+        entry = name
+        if self.profile and name in self.grammar.rules:
+            text += self._profile_wrapper_text(name)
+            entry = name + '__p'
+        if memoize and self.incremental:
+            text += self._incremental_wrapper_text(name, entry)
+        elif memoize:
+            # The body of the rule may return early, so the lookup and
+            # the store are done in a wrapper around it. Successes are
+            # stored as (val, pos) tuples and failures as False, so that
+            # failures don't take up any space beyond the dict entry.
+            i = self._memo_indices[name]
+            text += '    def _%s_(self):\n' % entry
+            text += '        cache = self._cache[%d]\n' % i
+            text += '        p = self.pos\n'
+            text += '        r = cache.get(p)\n'
+            text += '        if r is None:\n'
+            if name not in self.grammar.leaders:
+                text += '            self._%s__m_()\n' % name
+            if self.profile:
+                text += '            self._profile[%d][4] += 1\n' % (
+                    self._rule_indices[name])
+            if self.memo_limit is not None and (
+                    name in self.grammar.leaders):
+                # Evict the oldest entry that isn't a seed still being
+                # grown, since planting a new seed for it would recurse
+                # forever; only those seeds can go over the limit.
+                text += '            if len(cache) >= %d:\n' % (
+                    max(self.memo_limit, 1))
+                text += '                k = next((k for k in cache\n'
+                text += '                          if (%d, k) not in ' % i
+                text += 'self._growing), None)\n'
+                text += '                if k is not None:\n'
+                text += '                    del cache[k]\n'
+                text += '                    self._evictions[%d] += 1\n' % i
+            elif self.memo_limit is not None:
+                # Evict the oldest entry to stay within the limit; this is
+                # usually the one furthest behind the current position.
+                text += '            if len(cache) >= %d:\n' % (
+                    max(self.memo_limit, 1))
+                text += '                cache.popitem(last=False)\n'
+                text += '                self._evictions[%d] += 1\n' % i
+            if name in self.grammar.leaders:
+                text += self._seed_growing_text(
+                    name, 'r = cache[p] = False', 'r and self.pos <= r[1]',
+                    'r = cache[p] = (self.val, self.pos)',
+                    '(%d, p)' % i if self.memo_limit is not None else None)
+                text += '        if r is False:\n'
+            else:
+                text += '            if self.failed:\n'
+                text += '                cache[p] = False\n'
+                text += '            else:\n'
+                text += '                cache[p] = (self.val, self.pos)\n'
+                text += '        elif r is False:\n'
+            text += '            self.val = None\n'
+            text += '            self.failed = True\n'
+            text += '        else:\n'
+            text += '            self.val, self.pos = r\n'
+            text += '            self.failed = False\n'
+            text += '\n'
+        body = name + '__m' if memoize else entry
+        if self.heatmap and name in self.grammar.rules:
+            text += self._heatmap_wrapper_text(name, body)
+            body = name + '__h'
+        text += '    def _%s_(self):\n' % body
         for line in lines:
             text += '        %s\n' % line
-        if memoize:
-            text += '        self._cache[("%s", pos)] = (' % name
-            text += 'self.val, self.failed, self.pos)\n'
         return text
 
-    def _compile(self, node, rule, sub_type='', index=0, top_level=False):
-        assert node
-        assert self._method_lines == []
-        if node[0] == 'apply':
-            if node[1] not in self.grammar.rules:
-                self._builtin_rules_needed.add(node[1])
-            return 'self._%s_' % node[1]
-        elif node[0] == 'lit' and not top_level:
-            self._expect_needed = True
-            expr = string_literal.encode(node[1])
-            if len(node[1]) == 1:
-                return 'lambda: self._ch(%s)' % (expr,)
-            else:
-                return 'lambda: self._str(%s)' % (expr,)
+    def _profile_wrapper_text(self, name):
+        # When profiling, each rule is timed by a wrapper around the rest
+        # of its code. The time spent in the rules it calls is added up
+        # in _child_time as they return, so that it can be subtracted to
+        # get the time spent in the rule itself.
+        text = '    def _%s_(self):\n' % name
+        text += '        row = self._profile[%d]\n' % (
+            self._rule_indices[name])
+        text += '        outer = self._child_time\n'
+        text += '        self._child_time = 0.0\n'
+        text += '        start = time.perf_counter()\n'
+        text += '        self._%s__p_()\n' % name
+        text += '        elapsed = time.perf_counter() - start\n'
+        text += '        row[0] += 1\n'
+        text += '        row[1] += elapsed\n'
+        text += '        row[2] += elapsed - self._child_time\n'
+        text += '        if self.failed:\n'
+        text += '            row[3] += 1\n'
+        text += '        self._child_time = outer + elapsed\n'
+        text += '\n'
+        return text
+
+    def _heatmap_wrapper_text(self, name, entry):
+        # For a heatmap, every time a rule is actually matched (rather than
+        # found in the memo cache) is counted by position, in a dict keyed
+        # by the position and the rule's number. The stack of rules being
+        # matched is also kept, and saved when a position is first matched
+        # again.
+        text = '    def _%s_(self):\n' % entry
+        text += '        key = self.pos * %d + %d\n' % (
+            len(self.grammar.rules), self._rule_indices[name])
+        text += '        n = self._attempts.get(key, 0) + 1\n'
+        text += '        self._attempts[key] = n\n'
+        text += '        if n == 2:\n'
+        text += '            self._stacks[key] = tuple(self._stack)\n'
+        text += '        self._stack.append(%d)\n' % (
+            self._rule_indices[name])
+        text += '        self._%s__h_()\n' % name
+        text += '        self._stack.pop()\n'
+        text += '\n'
+        return text
+
+    def _incremental_wrapper_text(self, name, entry):
+        # When parsing incrementally, the results are stored by position
+        # rather than by rule, so that reparse() can just splice the list
+        # of positions to remove the results that start in the edited text
+        # and move the ones after it. To make that work, each result also
+        # records the furthest position that was looked at while producing
+        # it (so reparse() can tell whether the edit could have changed
+        # it) and the furthest error position (so that errors are reported
+        # the same way whether the result is reused or not). Those are
+        # tracked from the start of the rule, stored relative to it, and
+        # then merged back into the caller's.
+        i = self._memo_indices[name]
+        text = '    def _%s_(self):\n' % entry
+        text += '        p = self.pos\n'
+        text += '        column = self._cache[p]\n'
+        text += '        r = column.get(%d) if column else None\n' % i
+        text += '        if r is None:\n'
+        text += '            errpos, examined = self.errpos, self._examined\n'
+        text += '            self.errpos = self._examined = p\n'
+        leader = name in self.grammar.leaders
+        if not leader:
+            text += '            self._%s__m_()\n' % name
+        if self.profile:
+            text += '            self._profile[%d][4] += 1\n' % (
+                self._rule_indices[name])
+        if leader:
+            # The seed and the results it grows into are stored without
+            # the positions, which are filled in once it's fully grown.
+            text += '            column = self._cache[p]\n'
+            text += '            if column is None:\n'
+            text += '                column = self._cache[p] = {}\n'
+            text += self._seed_growing_text(
+                name, 'r = column[%d] = (None, None, 0, 0)' % i,
+                'r[1] is not None and self.pos - p <= r[1]',
+                'r = column[%d] = (self.val, self.pos - p, 0, 0)' % i)
+        text += '            x = max(self.errpos, self._examined, self.pos)\n'
+        if leader:
+            text += '            r = column[%d] = (r[0], r[1], ' % i
+            text += 'self.errpos - p, x - p)\n'
+        else:
+            text += '            column = self._cache[p]\n'
+            text += '            if column is None:\n'
+            text += '                column = self._cache[p] = {}\n'
+            text += '            if self.failed:\n'
+            text += '                column[%d] = (None, None, ' % i
+            text += 'self.errpos - p, x - p)\n'
+            text += '            else:\n'
+            text += '                column[%d] = (self.val, ' % i
+            text += 'self.pos - p, self.errpos - p, x - p)\n'
+        text += '            if self._max_span < x - p:\n'
+        text += '                self._max_span = x - p\n'
+        text += '            self.errpos = max(errpos, self.errpos)\n'
+        text += '            self._examined = max(examined, x)\n'
+        if leader:
+            indent = '        '
+        else:
+            text += '        else:\n'
+            indent = '            '
+        text += indent + 'self.val, n, e, x = r\n'
+        text += indent + 'if n is None:\n'
+        text += indent + '    self.failed = True\n'
+        text += indent + 'else:\n'
+        text += indent + '    self.pos = p + n\n'
+        text += indent + '    self.failed = False\n'
+        text += indent + 'self.errpos = max(self.errpos, p + e)\n'
+        text += indent + 'self._examined = max(self._examined, p + x)\n'
+        text += '\n'
+        return text
+
+    def _seed_growing_text(self, name, seed, shorter, store, key=None):
+        # Stores the seed, then keeps matching the leader's body and
+        # storing each result until one isn't longer than the last (see
+        # Analyzer.compute_left_recursion()). Its applies at the same
+        # position find the last result in the cache rather than recursing.
+        # If a key is given, it's in self._growing while the seed grows.
+        text = '            %s\n' % seed
+        if key:
+            text += '            self._growing.add(%s)\n' % key
+        text += '            while True:\n'
+        text += '                self._%s__m_()\n' % name
+        text += '                if self.failed or %s:\n' % shorter
+        text += '                    break\n'
+        text += '                %s\n' % store
+        text += '                self.pos = p\n'
+        if key:
+            text += '            self._growing.discard(%s)\n' % key
+        return text
+
+    def _compile(self, node, rule, sub_type='', index=0, top_level=False,
+                 inline=_INLINE_CALL, value_used=None):
+        """Returns the lines of code needed to match `node`.
+
+        If the lines can't be inlined into the caller (as determined by
+        `inline`), they are moved into a new method and a call to that
+        method is returned instead.
+
+        `value_used` indicates whether anything can look at the value
+        produced by the node; if it is None, it is the same as for the
+        parent node.
+        """
+        if sub_type:
+            sub_rule = '%s__%s%d' % (rule, sub_type, index)
+        else:
+            sub_rule = rule
+        saved_lines = self._method_lines
+        saved_value_used = self._value_used
+        self._method_lines = []
+        if value_used is not None:
+            self._value_used = value_used
+        ranges = None
+        if node[0] in ('apply', 'choice'):
+            ranges = self.grammar.char_class(node)
+        if ranges is not None:
+            self._char_class_(node[1] if node[0] == 'apply' else sub_rule,
+                              ranges)
         else:
-            if sub_type:
-                sub_rule = '%s__%s%d' % (rule, sub_type, index)
-            else:
-                sub_rule = rule
             fn = getattr(self, '_%s_' % node[0])
             if top_level and node[0] in ('seq', 'choice'):
                 fn(sub_rule, node, top_level)
             else:
                 fn(sub_rule, node)
+        lines = self._method_lines
+        self._method_lines = saved_lines
+        self._value_used = saved_value_used
 
-            if (not top_level and len(self._method_lines) == 1 and
-                    not 'lambda' in self._method_lines[0]):
-                r = 'lambda: ' + self._method_lines[0]
-                self._method_lines = []
-                return r
-
-            assert sub_rule not in self._methods
-            self._methods[sub_rule] = self._method_lines
-            self._method_lines = []
-            return 'self._%s_' % sub_rule
+        if sub_type or not top_level:
+            if inline == _INLINE_BLOCK and not any(
+                    line.lstrip().startswith('return') for line in lines):
+                return lines
+            if len(lines) == 1:
+                return lines
 
-    def _dedent(self):
-        self.indent -= 1
+        assert sub_rule not in self._methods
+        self._methods[sub_rule] = lines
+        return ['self._%s_()' % sub_rule]
 
     def _eval_rule(self, rule, node):
         fn = getattr(self, '_' + node[0] + '_')
@@ -455,64 +1327,185 @@ class Compiler(object):
                 return True
         return False
 
-    def _indent(self):
-        self.indent += 1
+    def _has_cut(self, node):
+        """Returns whether `node` is a sequence containing a cut, which
+        commits its caller to it once the cut has been passed (see
+        _seq_())."""
+        return node[0] == 'seq' and any(n[0] == 'cut' for n in node[1])
 
-    def _rule_can_fail(self, node):
+    def _can_fail(self, node):
         if node[0] == 'post':
-            if node[2] in ('?', '*'):
-                return False
-            return True
-        if node[0] == 'label':
-            return self._rule_can_fail(node[1])
-        if node[0] in ('choice', 'seq'):
-            if any(self._rule_can_fail(n) for n in node[1]):
+            if self._has_cut(node[1]):
                 return True
+            return node[2] == '+' and self._can_fail(node[1])
+        if node[0] == 'label':
+            return self._can_fail(node[1])
+        if node[0] in ('action', 'cut', 'empty'):
             return False
-        if node[0] == 'apply':
-            if node[1] in self.grammar.rules:
-              return self._rule_can_fail(self.grammar.rules[node[1]])
-            # This must be a builtin, and all of the builtin rules can fail.
-            return True
         return True
 
-    def _chain(self, name, args):
-        if len(args) == 1:
-            self._ext('self._%s([%s])' % (name, args[0]))
-            return
-        pfx = 'self._%s([' % name
-        line = '%s%s' % (pfx, args[0])
-        for arg in args[1:-1]:
-            if len(line) + len(arg) < 70:
-                line += ', %s' % arg
-            else:
-                self._ext(line + ',')
-                line = ' ' * len(pfx) + arg
-        if len(line) + len(args[-1]) < 70:
-            self._ext('%s, %s])' % (line, args[-1]))
-        else:
-            self._ext('%s,' % line)
-            self._ext('%s%s])' % (' ' * len(pfx), args[-1]))
-
     #
     # Handlers for each non-host node in the glop AST follow.
     #
 
     def _choice_(self, rule, node, top_level=False):
-        sub_rules = [self._compile(sub_node, rule, 'c', i, top_level)
-                     for i, sub_node in enumerate(node[1])]
-        self._chain('choose', sub_rules)
+        if all(n[0] == 'lit' and n[1] for n in node[1]):
+            self._strs_(rule, node)
+            return
+
+        guards = [self._first_char_guard(rule, sub_node, i, top_level)
+                  for i, sub_node in enumerate(node[1])]
+        self._ext('p = self.pos')
+        if any(guards):
+            self._ext('c = %s if %s else %s' % (
+                self._char_at('p'), self._in_input('p'),
+                '-1' if self.binary else "''"))
+        last = len(node[1]) - 1
+        for i, sub_node in enumerate(node[1]):
+            sub_lines = self._compile(sub_node, rule, 'c', i, top_level)
+            if i < last and self._has_cut(sub_node):
+                # Once the cut is passed, the alternatives after this one
+                # aren't tried, whether or not this one succeeds.
+                assert len(sub_lines) == 1
+                sub_lines = ['if %s:' % sub_lines[0],
+                             '    return',
+                             'self._rewind(p)']
+            elif i < last:
+                sub_lines += ['if not self.failed:',
+                              '    return',
+                              'self._rewind(p)']
+            if not guards[i]:
+                self._ext(*sub_lines)
+                continue
+
+            # Alternatives that can't start with the next character are
+            # skipped, but if the first one is skipped we still need to
+            # record that the parse failed at this position, so that
+            # the error messages are the same as if it had been tried.
+            self._ext('if %s:' % guards[i])
+            self._ext(*['    ' + line for line in sub_lines])
+            if i == last:
+                self._ext('else:',
+                          '    self._fail()')
+            elif i == 0:
+                self._ext('elif self.errpos < p:',
+                          '    self.errpos = p')
+
+    def _strs_(self, rule, node):
+        """Matches a choice between literals by looking up the literals that
+        start with the next character in a table (in their original order).
+
+        Each entry in the table also records whether the first literal
+        in the choice would've been skipped, so that errpos can be updated
+        the same way it is for other choices (see _choice_())."""
+        self._expect_needed = True
+        self._strs_needed = True
+        strs = [n[1] for n in node[1]]
+        entries = []
+        for ch in sorted(set(s[0] for s in strs)):
+            strs_for_ch = [self._str_expr(s) for s in strs if s[0] == ch]
+            if len(strs_for_ch) == 1:
+                strs_for_ch.append('')
+            entries.append('%s: (%s, (%s))' % (
+                self._char_expr(ch), strs[0][0] != ch,
+                ', '.join(strs_for_ch).rstrip()))
+        name = self._constant('_STRS_%s' % rule,
+                              '{%s}' % ', '.join(entries))
+        self._ext('self._strs(%s)' % name)
+
+    def _first_char_guard(self, rule, node, index, top_level):
+        """Returns an expression testing whether `node` could match at the
+        current character, or '' if the node has to be tried regardless."""
+        chars, nullable = self.grammar.first_of(node)
+        if chars is None or nullable:
+            return ''
+
+        # Labels bound in a failing alternative of a nested choice are
+        # still visible afterwards, so those alternatives must be tried.
+        if not top_level and self._has_labels(node):
+            return ''
+
+        # So must alternatives that start with a lookahead, since it can
+        # fail past the current character, which changes the errors.
+        if self._looks_ahead(node, set()):
+            return ''
+
+        if len(chars) == 1:
+            return 'c == %s' % self._char_expr(list(chars)[0])
+        chars_str = ', '.join(self._char_expr(ch) for ch in sorted(chars))
+        if len(chars) <= _MAX_INLINE_SET_LEN:
+            return 'c in {%s}' % chars_str
+        name = self._constant('_FIRST_%s__c%d' % (rule, index),
+                              'frozenset([%s])' % chars_str)
+        return 'c in %s' % name
+
+    def _looks_ahead(self, node, visited):
+        """Returns whether a lookahead can be tried before `node` has
+        matched its first character."""
+        typ = node[0]
+        if typ == 'not':
+            return True
+        if typ == 'apply':
+            if node[1] in visited or node[1] not in self.grammar.rules:
+                return False
+            visited.add(node[1])
+            return self._looks_ahead(self.grammar.rules[node[1]], visited)
+        if typ in ('label', 'paren', 'post'):
+            return self._looks_ahead(node[1], visited)
+        if typ == 'choice':
+            return any(self._looks_ahead(n, visited) for n in node[1])
+        if typ == 'seq':
+            for n in node[1]:
+                if self._looks_ahead(n, visited):
+                    return True
+                if not self.grammar.first_of(n)[1]:
+                    return False
+        return False
+
+    def _constant(self, name, expr):
+        """Returns the name of a module-level constant with the given value,
+        adding it if there isn't one already."""
+        if expr not in self._constants:
+            self._constants[expr] = name
+        return self._constants[expr]
 
     def _seq_(self, rule, node, top_level=False):
-        sub_rules = [self._compile(sub_node, rule, 's', i)
-                     for i, sub_node in enumerate(node[1])]
+        # A sequence containing a cut returns True once the cut has been
+        # passed, so that the choice or repetition calling it knows not to
+        # try anything else if the rest of the sequence fails.
         needs_scope = top_level and self._has_labels(node)
         if needs_scope:
             self._bindings_needed = True
             self._ext("self._push('%s')" % rule)
-        self._chain('seq', sub_rules)
+            on_failure = ["    self._pop('%s')" % rule, '    return']
+        else:
+            on_failure = ['    return']
+        for i, sub_node in enumerate(node[1]):
+            is_last = i == len(node[1]) - 1
+            if sub_node[0] == 'cut':
+                on_failure = on_failure[:-1] + ['    return True']
+            if sub_node[0] == 'label' and not is_last:
+                # Check for failure before binding the value rather than
+                # checking twice.
+                self._bindings_needed = True
+                self._ext(*self._compile(sub_node[1],
+                                         '%s__s%d_l' % (rule, i),
+                                         inline=_INLINE_BLOCK,
+                                         value_used=True))
+                if self._can_fail(sub_node):
+                    self._ext('if self.failed:', *on_failure)
+                self._ext('self._set(%s, self.val)' %
+                          string_literal.encode(sub_node[2]))
+                continue
+            self._ext(*self._compile(sub_node, rule, 's', i,
+                                     inline=_INLINE_BLOCK,
+                                     value_used=None if is_last else False))
+            if not is_last and self._can_fail(sub_node):
+                self._ext('if self.failed:', *on_failure)
         if needs_scope:
             self._ext("self._pop('%s')" % rule)
+        if self._has_cut(node):
+            self._ext('return True')
 
     def _apply_(self, _rule, node):
         sub_rule = node[1]
@@ -522,39 +1515,320 @@ class Compiler(object):
 
     def _lit_(self, _rule, node):
         self._expect_needed = True
-        expr = string_literal.encode(node[1])
         if len(node[1]) == 1:
-            self._ext('self._ch(%s)' % (expr,))
+            self._ext('self._ch(%s)' % (self._char_expr(node[1]),))
         else:
-            self._ext('self._str(%s)' % (expr,))
+            self._ext('self._str(%s)' % (self._str_expr(node[1]),))
 
     def _label_(self, rule, node):
-        sub_rule = self._compile(node[1], rule + '_l')
-        self._ext('self._bind(%s, %s)' % (sub_rule,
-                                          string_literal.encode(node[2])))
+        self._bindings_needed = True
+        self._ext(*self._compile(node[1], rule + '_l', inline=_INLINE_BLOCK,
+                                 value_used=True))
+        var = string_literal.encode(node[2])
+        if self._can_fail(node[1]):
+            self._ext('if not self.failed:',
+                      '    self._set(%s, self.val)' % var)
+        else:
+            self._ext('self._set(%s, self.val)' % var)
 
     def _action_(self, rule, node):
         self._ext('self._succeed(%s)' % self._eval_rule(rule, node[1]))
 
+    def _cut_(self, _rule, _node):
+        # Nothing before the cut can be backtracked into by the caller, so
+        # (if memory is bounded) the memoized results for it can go.
+        if self.memoize and self.memo_limit is not None:
+            self._commit_needed = True
+            self._ext('self._commit()')
+        if self._value_used or not self._method_lines:
+            self._ext('self._succeed(None)')
+
     def _empty_(self, _rule, _node):
-        return
+        self._ext('self._succeed(None)')
 
     def _not_(self, rule, node):
-        sub_rule = self._compile(node[1], rule + '_n')
-        self._ext('self._not(%s)' % sub_rule)
+        self._ext('p = self.pos',
+                  'errpos = self.errpos')
+        self._ext(*self._compile(node[1], rule + '_n', value_used=False))
+        self._ext('if self.failed:',
+                  '    self._succeed(None, p)',
+                  'else:')
+        if self.incremental:
+            # The errors in the lookahead are thrown away, but what it
+            # looked at still matters.
+            self._ext('    self._examined = max(self._examined, self.errpos,'
+                      ' self.pos)')
+        self._ext('    self._rewind(p)',
+                  '    self.errpos = errpos',
+                  '    self._fail()')
 
     def _paren_(self, rule, node):
-        sub_rule = self._compile(node[1], rule + '_g')
-        self._ext('(%s)()' % sub_rule)
+        self._ext(*self._compile(node[1], rule + '_g'))
 
     def _post_(self, rule, node):
-        sub_rule = self._compile(node[1], rule + '_p')
+        is_split = node is self._split_node
+        if node[2] in ('*', '+') and not is_split and self._run_(rule, node):
+            return
+
+        sub_lines = self._compile(node[1], rule + '_p')
+        has_cut = self._has_cut(node[1])
+        if node[2] == '?' and has_cut:
+            # If the cut is passed, the repetition fails along with its
+            # body rather than matching nothing.
+            self._ext('p = self.pos',
+                      'cut = %s' % sub_lines[0],
+                      'if not self.failed:',
+                      '    self._succeed([self.val])',
+                      'elif not cut:',
+                      '    self._succeed([], p)')
+            return
         if node[2] == '?':
-            self._ext('self._opt(%s)' % sub_rule)
-        elif node[2] == '+':
-            self._ext('self._plus(%s)' % sub_rule)
+            self._ext('p = self.pos',
+                      *sub_lines)
+            self._ext('if self.failed:',
+                      '    self._succeed([], p)',
+                      'else:',
+                      '    self._succeed([self.val])')
+            return
+
+        loop = ['while True:',
+                '    p = self.pos']
+        if is_split:
+            # Skip over any items that were matched by parse_items().
+            self._split_lines = sub_lines
+            loop += ['    if p in self._presplit:',
+                     '        items, self.pos, errpos = self._presplit[p]',
+                     '        vs.extend(items)',
+                     '        self.errpos = max(self.errpos, errpos)',
+                     '        continue']
+        if has_cut:
+            loop += ['    cut = %s' % sub_lines[0],
+                     '    if self.failed:',
+                     '        if not cut:',
+                     '            self._succeed(vs, p)',
+                     '        break',
+                     '    vs.append(self.val)']
+        else:
+            loop += ['    ' + line for line in sub_lines]
+            loop += ['    if self.failed:',
+                     '        self._rewind(p)',
+                     '        break',
+                     '    vs.append(self.val)']
+        if id(node) in self._commit_nodes:
+            loop += ['    ' + self._commit_line()]
+        if not has_cut:
+            loop += ['self._succeed(vs)']
+        if node[2] == '+':
+            self._ext(*sub_lines)
+            self._ext('if not self.failed:',
+                      '    vs = [self.val]')
+            if id(node) in self._commit_nodes:
+                self._ext('    ' + self._commit_line())
+            self._ext(*['    ' + line for line in loop])
+        else:
+            self._ext('vs = []', *loop)
+
+    def _str_expr(self, s):
+        """Returns the literal to match `s` against the input with."""
+        if self.binary:
+            return string_literal.encode_bytes(s)
+        return string_literal.encode(s)
+
+    def _char_expr(self, ch):
+        """Returns the literal to compare a single character of the input
+        with (i.e., a value of _char_at())."""
+        if self.binary:
+            return str(ord(ch))
+        return string_literal.encode(ch)
+
+    def _in_input(self, pos):
+        """Returns an expression testing whether there's a character at
+        `pos`, reading more of the input first if need be."""
+        if self.streaming:
+            return '(%s < self.end or self._more(%s))' % (pos, pos)
+        return '%s < self.end' % pos
+
+    def _char_at(self, pos):
+        """Returns an expression for the character at `pos`, which must've
+        already been checked with _in_input()."""
+        if self.streaming:
+            return 'self.msg[%s - self._base]' % pos
+        return 'self.msg[%s]' % pos
+
+    def _commit_line(self):
+        """Returns the code to run after an item of a top-level repetition
+        of the starting rule has been matched (see _find_commit_nodes())."""
+        self._commit_needed = True
+        if self.streaming:
+            self._discard_needed = True
+            return 'self._discard()'
+        return 'self._commit()'
+
+    def _run_(self, rule, node):
+        """Matches a repetition with a single regexp, if possible.
+
+        This is possible when every iteration of the repetition can be
+        matched by a regexp that can't backtrack into a different match
+        (see _regexp()). If the value of the repetition is used, each
+        iteration must also match exactly one character, so that the
+        list of values is just the list of characters matched.
+
+        The errors (and, when parsing incrementally, the characters looked
+        at) must also end up the same as if each iteration had been
+        matched in turn. So the last, failing, iteration is still matched
+        normally, and no iteration that succeeds may fail at a character
+        past its end (see _widths()).
+
+        Returns whether the code was generated."""
+        # When streaming, a match could stop at the end of the buffered
+        # text rather than at the end of the repetition.
+        if self.streaming:
+            return False
+        pat = self._regexp(node[1], set())
+        if pat is None or self.grammar.first_of(node[1])[1]:
+            return False
+        if self._value_used and not self._is_single_char(node[1], set()):
+            return False
+        shortest, _, furthest = self._widths(node[1], set())
+        if furthest > shortest:
+            return False
+
+        name = self._constant('_RUN_%s' % rule, 're.compile(%s, re.S)' %
+                              self._str_expr(
+                                  '(?:%s)%s' % (pat[0], node[2])))
+        if not self._value_used:
+            val = 'None'
+        elif self.binary:
+            val = '[_BYTES[b] for b in m.group()]'
+        else:
+            val = 'list(m.group())'
+
+        sub_lines = self._compile(node[1], rule + '_p', value_used=False)
+        self._ext('m = %s.match(self.msg, self.pos)' % name)
+        if node[2] == '*':
+            self._ext('self.pos = m.end()',
+                      *sub_lines)
+            self._ext('self._succeed(%s, m.end())' % val)
         else:
-            self._ext('self._star(%s)' % sub_rule)
+            self._ext('if m:',
+                      '    self.pos = m.end()',
+                      *sub_lines)
+            self._ext('if m:',
+                      '    self._succeed(%s, m.end())' % val)
+        return True
+
+    def _widths(self, node, visiting):
+        """Returns a (shortest, longest, furthest) tuple for a node that
+        _regexp() returned a pattern for: the lengths of its shortest and
+        longest matches, and the furthest offset from where it starts at
+        which it may look at a character (and so fail) while being
+        matched."""
+        typ = node[0]
+        if typ == 'lit':
+            return len(node[1]), len(node[1]), max(len(node[1]) - 1, 0)
+        if self.grammar.char_class(node) is not None:
+            return 1, 1, 0
+        if typ == 'apply':
+            if node[1] == 'anything':
+                return 1, 1, 0
+            if node[1] == 'end':
+                return 0, 0, 0
+            visiting.add(node[1])
+            r = self._widths(self.grammar.rules[node[1]], visiting)
+            visiting.remove(node[1])
+            return r
+        if typ == 'paren':
+            return self._widths(node[1], visiting)
+        if typ == 'not':
+            return 0, 0, self._widths(node[1], visiting)[2]
+        if typ == 'seq':
+            shortest, longest, furthest = 0, 0, 0
+            for n in node[1]:
+                r = self._widths(n, visiting)
+                furthest = max(furthest, longest + r[2])
+                shortest += r[0]
+                longest += r[1]
+            return shortest, longest, furthest
+        rs = [self._widths(n, visiting) for n in node[1]]
+        return (min(r[0] for r in rs), max(r[1] for r in rs),
+                max(r[2] for r in rs))
+
+    def _regexp(self, node, visiting):
+        """Returns a (pattern, is_simple) tuple for a regexp that matches
+        the same thing `node` does, or None if there isn't one.
+
+        Regexps backtrack into alternatives that have already matched
+        when something after them fails, and PEGs don't, so a regexp is
+        only returned when that can't happen: only the last element of a
+        sequence may be something that isn't "simple" (i.e., that could
+        match in more than one way)."""
+        typ = node[0]
+        if typ == 'lit':
+            return re.escape(node[1]), True
+        ranges = self.grammar.char_class(node)
+        if ranges is not None:
+            return _re_class(ranges, self.binary), True
+        if typ == 'apply':
+            if node[1] == 'anything':
+                return '.', True
+            if node[1] == 'end':
+                return '\\Z', True
+            if node[1] not in self.grammar.rules or node[1] in visiting:
+                return None
+            visiting.add(node[1])
+            r = self._regexp(self.grammar.rules[node[1]], visiting)
+            visiting.remove(node[1])
+            return r
+        if typ == 'paren':
+            return self._regexp(node[1], visiting)
+        if typ == 'not':
+            r = self._regexp(node[1], visiting)
+            if r is None:
+                return None
+            return '(?!%s)' % r[0], True
+        if typ == 'seq':
+            pats = []
+            is_simple = True
+            for n in node[1]:
+                r = self._regexp(n, visiting)
+                if r is None or not is_simple:
+                    return None
+                pats.append(r[0])
+                is_simple = r[1]
+            return ''.join(pats), is_simple
+        if typ == 'choice':
+            pats = []
+            for n in node[1]:
+                r = self._regexp(n, visiting)
+                if r is None:
+                    return None
+                pats.append(r[0])
+            return '(?:%s)' % '|'.join(pats), False
+        return None
+
+    def _is_single_char(self, node, visiting):
+        """Returns whether every match of `node` is exactly one character
+        long and produces that character as its value."""
+        typ = node[0]
+        if self.grammar.char_class(node) is not None:
+            return True
+        if typ == 'apply':
+            if node[1] == 'anything':
+                return True
+            if node[1] not in self.grammar.rules or node[1] in visiting:
+                return False
+            visiting.add(node[1])
+            r = self._is_single_char(self.grammar.rules[node[1]], visiting)
+            visiting.remove(node[1])
+            return r
+        if typ == 'paren':
+            return self._is_single_char(node[1], visiting)
+        if typ == 'choice':
+            return all(self._is_single_char(n, visiting) for n in node[1])
+        if typ == 'seq':
+            return (all(n[0] == 'not' for n in node[1][:-1]) and
+                    self._is_single_char(node[1][-1], visiting))
+        return False
 
     def _pred_(self, rule, node):
         self._ext('v = %s' % self._eval_rule(rule, node[1]),
@@ -563,10 +1837,41 @@ class Compiler(object):
                   'else:',
                   '    self._fail()')
 
-    def _range_(self, _rule, node):
-        self._range_needed = True
-        self._ext('self._range(%s, %s)' % (string_literal.encode(node[1][1]),
-                                           string_literal.encode(node[2][1])))
+    def _range_(self, rule, node):
+        self._char_class_(rule, self.grammar.char_class(node))
+
+    def _char_class_(self, rule, ranges):
+        if len(ranges) == 1 and ranges[0][0] == ranges[0][1]:
+            self._lit_(rule, ['lit', chr(ranges[0][0])])
+            return
+
+        size = sum(hi - lo + 1 for lo, hi in ranges)
+        if size <= _MAX_CHAR_SET_LEN:
+            chars = [chr(i) for lo, hi in ranges for i in range(lo, hi + 1)]
+            name = self._constant('_CHARS_%s' % rule, 'frozenset([%s])' %
+                                  ', '.join(self._char_expr(ch)
+                                            for ch in chars))
+            test = '%s and %s in %s' % (self._in_input('p'),
+                                        self._char_at('p'), name)
+        else:
+            name = self._constant('_CHARS_%s' % rule, 're.compile(%s)' %
+                                  string_literal.encode(_re_class(ranges)))
+            if self.streaming:
+                test = '%s and %s.match(self.msg, p - self._base)' % (
+                    self._in_input('p'), name)
+            else:
+                test = '%s.match(self.msg, p)' % name
+        if self.binary:
+            val = '_BYTES[%s]' % self._char_at('p')
+        else:
+            val = self._char_at('p')
+        self._ext('p = self.pos',
+                  'if %s:' % test,
+                  '    self.val = %s' % val,
+                  '    self.failed = False',
+                  '    self.pos = p + 1',
+                  'else:',
+                  '    self._fail()')
 
     #
     # Handlers for the host nodes in the AST
@@ -586,6 +1891,10 @@ class Compiler(object):
         return '[' + str(self._eval_rule(rule, node[1])) + ']'
 
     def _ll_lit_(self, _rule, node):
+        # When matching bytes, ASCII strings in the actions are bytes too,
+        # so that they can be combined with what was matched.
+        if self.binary and all(ord(ch) < 128 for ch in node[1]):
+            return string_literal.encode_bytes(node[1])
         return string_literal.encode(node[1])
 
     def _ll_num_(self, _rule, node):
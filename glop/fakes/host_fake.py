@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import fnmatch
 import io
 import sys
 
@@ -39,7 +40,7 @@ class FakeHost(object):
         return self.join(self.cwd, relpath)
 
     def basename(self, path):
-        return '/'.join(path.split('/')[-1])
+        return path.split('/')[-1]
 
     def chdir(self, *comps):
         path = self.join(*comps)
@@ -64,6 +65,16 @@ class FakeHost(object):
     def getcwd(self):
         return self.cwd
 
+    def glob(self, pattern):
+        # Unlike with fnmatch, wildcards don't match across directories.
+        full_pattern = self.abspath(pattern)
+        paths = sorted(f for f in self.files if self.files[f] is not None and
+                       fnmatch.fnmatch(f, full_pattern) and
+                       f.count('/') == full_pattern.count('/'))
+        if pattern.startswith('/'):
+            return paths
+        return [self.relpath(f, self.cwd) for f in paths]
+
     def join(self, *comps):
         p = ''
         for c in comps:
@@ -90,6 +101,9 @@ class FakeHost(object):
     def make_executable(self, path):
         pass
 
+    def map_file(self, *comps):
+        return self._read(comps).encode('utf-8')
+
     def maybe_mkdir(self, *comps):
         path = self.abspath(self.join(*comps))
         if path not in self.dirs:
@@ -111,11 +125,17 @@ class FakeHost(object):
         self.dirs.add(self.last_tmpdir)
         return self.last_tmpdir
 
+    def open_text_file(self, *comps):
+        return io.StringIO(self._read(comps))
+
     def print_(self, msg, end='\n', stream=None):
         stream = stream or self.stdout
         stream.write(unicode(msg) + end)
         stream.flush()
 
+    def read_binary_file(self, *comps):
+        return self._read(comps).encode('utf-8')
+
     def read_text_file(self, *comps):
         return self._read(comps)
 
@@ -0,0 +1,541 @@
+# Copyright 2014 Dirk Pranke. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import string
+
+from glop.analyzer import Analyzer
+from glop.interpreter import Interpreter
+
+
+# About how many characters to spend on each item of a repetition (or of
+# a recursive list) when it's being repeated to make the input bigger, and
+# on everything else (or less, for inputs smaller than this).
+_ITEM_SIZE = 100
+
+# Past this many nested rules, the shortest way of matching each rule is
+# used, so that recursive rules always bottom out.
+_MAX_DEPTH = 30
+
+# How many times to try to generate a string that the rule it was
+# generated from actually matches before giving up and using it anyway.
+_MAX_TRIES = 10
+
+# How many different items to generate for each repetition that's being
+# grown. Past that, the items are picked from the ones already generated,
+# which is a lot faster than generating (and checking) new ones.
+_POOL_SIZE = 1000
+
+# What `anything` generates. Lookaheads like ~'*/' or ~eol are almost
+# always true for these, which is what they're usually guarding.
+_ANYTHING = string.ascii_letters + string.digits
+
+_INF = float('inf')
+
+
+class Generator(object):
+    """Generates random inputs for a grammar, of more or less any size.
+
+    The AST of the grammar is walked, picking random alternatives and
+    numbers of repetitions along the way. To make big inputs, the
+    generator looks for the repetition (or recursive rule, like a list
+    that's defined as an item followed by the rest of the list) whose
+    items are the most complicated, and repeats that as often as needed,
+    generating everything else at a more typical size.
+
+    Lookaheads are mostly taken care of by not generating a character
+    that the lookahead (or a repetition that just ended) could start with
+    next. For whatever that misses (and for semantic predicates), if
+    `check` is true, the strings generated are checked by parsing them:
+    each string generated from a rule on its own is checked against that
+    rule, and each item of the big repetitions is checked next to other
+    items. The ones that don't match are generated again (or, for items,
+    left out). The result is still not guaranteed to be matched by the
+    grammar as a whole, but it almost always is."""
+
+    def __init__(self, grammar, seed=None, global_vars=None, check=True):
+        self.grammar = grammar
+        self.global_vars = global_vars
+        self.check = check
+        self._rnd = random.Random(seed)
+        self._out = []
+        self._len = 0
+        self._forbidden = frozenset()
+        self._checking = False
+        self._pools = {}
+        self._prev_items = {}
+        self._interpreters = {}
+        self._item_size = _ITEM_SIZE
+
+        self._min_lens = dict.fromkeys(grammar.rules, _INF)
+        _fixed_point(grammar, self._min_lens,
+                     lambda _rule, node: self._min_len(node))
+        self._heights = dict.fromkeys(grammar.rules, _INF)
+        _fixed_point(grammar, self._heights,
+                     lambda _rule, node: self._height(node))
+        self._depths = {}
+        for rule in grammar.rules:
+            self._rule_depth(rule, set())
+        self._scores = dict.fromkeys(grammar.rules)
+        _fixed_point(grammar, self._scores, self._score)
+
+    def generate(self, size=0):
+        """Returns a random string matched by the starting rule that's
+        at least `size` characters long, if the grammar allows it."""
+        self._out = []
+        self._len = 0
+        self._forbidden = frozenset()
+        self._prev_items = {}
+
+        # The input is grown whenever it's asked for at a size bigger than
+        # an item's, so that has to be smaller than the size asked for.
+        self._item_size = min(_ITEM_SIZE, max(size - 1, 0))
+        self._apply_(None, ['apply', self.grammar.starting_rule], size, 0)
+        return ''.join(self._out)
+
+    def _gen(self, rule, node, budget, depth):
+        """Appends a string generated from the node to the output.
+
+        `budget` is about how many characters to generate. If it's more
+        than an item's worth, the node is grown to fit it; otherwise the
+        node is generated as it comes."""
+        fn = getattr(self, '_%s_' % node[0], None)
+        if fn:
+            fn(rule, node, budget, depth)
+
+    def _emit(self, s):
+        if s:
+            self._out.append(s)
+            self._len += len(s)
+            self._forbidden = frozenset()
+
+    def _forbid(self, node):
+        """Keeps the next character from being one that the node could
+        start with.
+
+        This is done after a repetition, since the parser would keep
+        repeating it otherwise, and for lookaheads. (It's more than
+        is needed, since the node might not match even if the character
+        is one it could start with, but it's generally close enough.)"""
+        chars, _ = self.grammar.first_of(node)
+        if chars:
+            self._forbidden |= chars
+
+    def _blocked(self, node):
+        # Whether the node has to start with a forbidden character.
+        chars, nullable = self.grammar.first_of(node)
+        return (not nullable and chars is not None and
+                chars <= self._forbidden)
+
+    def _pick(self, chars):
+        allowed = [ch for ch in chars if ch not in self._forbidden]
+        return self._rnd.choice(allowed or chars)
+
+    def _growing(self, rule, node, budget):
+        return (budget > self._item_size and
+                self._score(rule, node) is not None)
+
+    def _item_budget(self):
+        # Even for the smallest inputs, items get room for a character or
+        # so more than their shortest match (like the newline that ends a
+        # line), since that's often what sets them apart.
+        return self._rnd.randint(0, max(self._item_size, 1))
+
+    def _grown_budget(self, budget):
+        # The part of a node that's being grown keeps growing until the
+        # budget runs out, even once what's left of it is no more than an
+        # item's worth.
+        return max(budget, self._item_size + 1) if budget > 0 else budget
+
+    def _apply_(self, rule, node, budget, depth):
+        name = node[1]
+        if name == 'anything':
+            self._emit(self._pick(_ANYTHING))
+            return
+        if name not in self.grammar.rules:
+            return
+        body = self.grammar.rules[name]
+        if (self._growing(name, body, budget) or self._checking or
+                not self.check):
+            self._gen(name, body, budget, depth + 1)
+            return
+
+        # Otherwise, this is the outermost rule of the piece being
+        # generated, so check that the rule really does match it.
+        self._checked(lambda: self._gen(name, body, budget, depth + 1),
+                      lambda text: self._matches(name, node, text))
+
+    def _repeat(self, key, rule, node, budget, depth):
+        """Generates items of a repetition (or a list) until there are
+        `budget` characters of them."""
+        start = self._len
+        misses = 0
+        while self._len - start < budget and misses < _MAX_TRIES:
+            item_start = self._len
+            if not self._item(key, rule, node, depth):
+                misses += 1
+            elif self._len == item_start:
+                break
+            else:
+                misses = 0
+
+    def _item(self, key, rule, node, depth):
+        """Generates an item of a repetition (or a list) that's being
+        grown, and returns whether it could.
+
+        Each new item is checked after the item before it and before
+        another one, and then again between two others, so that it's
+        likely to work next to any of them; once there are enough of
+        them, they're reused, checking just that they work after the item
+        before them. Items that don't work are left out (after a few
+        tries), since there can always be one item less."""
+        pool = self._pools.setdefault(key, [])
+        prev = self._prev_items.get(key)
+        start, start_len = len(self._out), self._len
+        forbidden = self._forbidden
+        for _ in range(_MAX_TRIES):
+            if len(pool) >= _POOL_SIZE:
+                text = self._rnd.choice(pool)
+                self._emit(text)
+                tests = [[prev, text]] if prev is not None else []
+            else:
+                self._gen(rule, node, self._item_budget(), depth)
+                text = ''.join(self._out[start:])
+                others = [self._rnd.choice(pool or [text]) for _ in range(3)]
+                tests = [[text if prev is None else prev, text, others[0]],
+                         [others[1], text, others[2]]]
+            if not self.check or all(
+                    self._matches((key, len(texts)),
+                                  ['seq', [node] * len(texts)],
+                                  ''.join(texts))
+                    for texts in tests):
+                if len(pool) < _POOL_SIZE:
+                    pool.append(text)
+                self._prev_items[key] = text
+                return True
+            self._truncate(start, start_len, forbidden)
+        return False
+
+    def _checked(self, gen, matches):
+        """Calls gen() to generate a string until matches() is true of
+        it (or it's been tried enough times)."""
+        self._checking = True
+        try:
+            start, start_len = len(self._out), self._len
+            forbidden = self._forbidden
+            for _ in range(_MAX_TRIES):
+                gen()
+                if matches(''.join(self._out[start:])):
+                    return
+                self._truncate(start, start_len, forbidden)
+            gen()
+        finally:
+            self._checking = False
+
+    def _truncate(self, start, start_len, forbidden):
+        del self._out[start:]
+        self._len = start_len
+        self._forbidden = forbidden
+
+    def _choice_(self, rule, node, budget, depth):
+        alts = node[1]
+        if self._growing(rule, node, budget):
+            best = max(self._score(rule, alt) for alt in alts
+                       if self._score(rule, alt) is not None)
+            alts = [alt for alt in alts if self._score(rule, alt) == best]
+        else:
+            # Only the starting rule should be matching the end of the
+            # input, and the alternatives have to start with something
+            # that's allowed.
+            alts = ([alt for alt in alts if not self._blocked(alt) and
+                     _first_element(alt) != ['apply', 'end']] or alts)
+            if depth > _MAX_DEPTH or budget <= 0:
+                alts = [min(alts, key=self._height)]
+            else:
+                alts = ([alt for alt in alts
+                         if self._min_len(alt) <= budget] or
+                        [min(alts, key=self._height)])
+        self._gen(rule, self._rnd.choice(alts), budget, depth)
+
+    def _seq_(self, rule, node, budget, depth):
+        start = self._len
+        if not self._growing(rule, node, budget):
+            for n in node[1]:
+                self._gen(rule, n, budget - (self._len - start), depth)
+            return
+
+        # Grow the element with the best score (preferring the rule
+        # itself, so that a recursive list is grown by adding items to
+        # it), and generate everything else as usual.
+        best = None
+        for n in node[1]:
+            best = _max(best, self._score(rule, n))
+        own = self._own_score(rule, node)
+        if own is not None and _max(own, best) == own:
+            grown = max(i for i, n in enumerate(node[1])
+                        if _unlabeled(n) == ['apply', rule])
+        else:
+            grown = [self._score(rule, n) for n in node[1]].index(best)
+        if (_unlabeled(node[1][grown]) == ['apply', rule] and
+                all(n[0] == 'action' for n in node[1][grown + 1:])):
+            # Rather than recursing for every item of the list, generate
+            # the items here, and then end the list as usual.
+            self._repeat((id(node), grown), rule, ['seq', node[1][:grown]],
+                         budget, depth)
+            self._gen(rule, node[1][grown], self._item_budget(), depth)
+            return
+        if (_unlabeled(node[1][grown]) == ['apply', rule] and
+                all(n[0] == 'action' for n in node[1][:grown])):
+            # Likewise for a left-recursive list, except that the items
+            # come after the start of it. The actions are left out of the
+            # items, since they may refer to the labels before them.
+            self._gen(rule, node[1][grown], self._item_budget(), depth)
+            self._repeat((id(node), grown), rule,
+                         ['seq', [n for n in node[1][grown + 1:]
+                                  if n[0] != 'action']],
+                         budget - (self._len - start), depth)
+            return
+
+        for i, n in enumerate(node[1]):
+            if i == grown:
+                self._gen(rule, n,
+                          self._grown_budget(budget - (self._len - start)),
+                          depth)
+            else:
+                self._gen(rule, n, self._item_budget(), depth)
+
+    def _label_(self, rule, node, budget, depth):
+        self._gen(rule, node[1], budget, depth)
+
+    def _paren_(self, rule, node, budget, depth):
+        self._gen(rule, node[1], budget, depth)
+
+    def _lit_(self, _rule, node, _budget, _depth):
+        self._emit(node[1])
+
+    def _range_(self, _rule, node, _budget, _depth):
+        lo, hi = ord(node[1][1]), ord(node[2][1])
+        # Stick to printable ASCII when the range allows it.
+        if lo < 127 and hi > 32:
+            lo, hi = max(lo, 32), min(hi, 126)
+        if hi - lo < 256:
+            self._emit(self._pick([chr(i) for i in range(lo, hi + 1)]))
+        else:
+            self._emit(chr(self._rnd.randint(lo, hi)))
+
+    def _post_(self, rule, node, budget, depth):
+        op = node[2]
+        if self._growing(rule, node, budget):
+            own = self._repetition_score(node)
+            inner = self._score(rule, node[1])
+            if own is None or (inner is not None and inner > own):
+                # One of the items has a bigger list to grow in it.
+                self._gen(rule, node[1], budget, depth)
+            else:
+                self._repeat(id(node), rule, node[1], budget, depth)
+                self._forbid(node[1])
+            return
+
+        if depth > _MAX_DEPTH or budget <= 0:
+            count = 1 if op == '+' else 0
+        else:
+            count = self._rnd.randint(1 if op == '+' else 0,
+                                      1 if op == '?' else 3)
+        start = self._len
+        for _ in range(count):
+            self._gen(rule, node[1], budget - (self._len - start), depth)
+        if op != '?' or not count:
+            self._forbid(node[1])
+
+    def _not_(self, _rule, node, _budget, _depth):
+        self._forbid(node[1])
+
+    # These don't generate anything.
+    def _action_(self, _rule, _node, _budget, _depth):
+        pass
+
+    _cut_ = _empty_ = _pred_ = _action_
+
+    #
+    # Measures of the nodes.
+    #
+
+    def _min_len(self, node):
+        """Returns the fewest characters the node can match."""
+        typ = node[0]
+        if typ == 'lit':
+            return len(node[1])
+        if typ == 'range':
+            return 1
+        if typ == 'apply':
+            if node[1] == 'anything':
+                return 1
+            return self._min_lens.get(node[1], 0)
+        if typ in ('label', 'paren'):
+            return self._min_len(node[1])
+        if typ == 'post':
+            return self._min_len(node[1]) if node[2] == '+' else 0
+        if typ == 'seq':
+            return sum(self._min_len(n) for n in node[1])
+        if typ == 'choice':
+            return min(self._min_len(n) for n in node[1])
+        return 0
+
+    def _height(self, node):
+        """Returns how deeply rules must be nested to match the node.
+
+        Always taking the choice with the smallest height is a way of
+        matching a rule that's guaranteed to finish."""
+        typ = node[0]
+        if typ == 'apply':
+            if node[1] not in self.grammar.rules:
+                return 0
+            return 1 + self._heights[node[1]]
+        if typ in ('label', 'paren'):
+            return self._height(node[1])
+        if typ == 'post':
+            return self._height(node[1]) if node[2] == '+' else 0
+        if typ == 'seq':
+            return max([0] + [self._height(n) for n in node[1]])
+        if typ == 'choice':
+            return min(self._height(n) for n in node[1])
+        return 0
+
+    def _rule_depth(self, rule, active):
+        """Returns how deeply rules can be nested under the rule (which
+        is infinite for recursive rules and the rules that use them)."""
+        if rule in self._depths:
+            return self._depths[rule]
+        if rule in active:
+            return _INF
+        active.add(rule)
+        depth = self._depth(self.grammar.rules[rule], active)
+        active.remove(rule)
+        self._depths[rule] = depth
+        return depth
+
+    def _depth(self, node, active=None):
+        typ = node[0]
+        if typ == 'apply':
+            if node[1] not in self.grammar.rules:
+                return 0
+            return 1 + self._rule_depth(node[1], active or set())
+        if typ in ('label', 'paren', 'post'):
+            return self._depth(node[1], active)
+        if typ in ('seq', 'choice'):
+            return max([0] + [self._depth(n, active) for n in node[1]])
+        return 0
+
+    def _repetition_score(self, node):
+        if node[2] == '?':
+            return None
+        return (self._depth(node[1]), 0)
+
+    def _score(self, rule, node):
+        """Returns how good a place to grow the input the node leads to,
+        or None if it can't be grown.
+
+        Repetitions (and seqs that apply their own rule again) are the
+        places that can be grown. The ones whose items can be nested the
+        most deeply are the best, and, of those, the ones reached
+        through the fewest rules."""
+        typ = node[0]
+        if typ == 'apply':
+            if node[1] == rule or node[1] not in self.grammar.rules:
+                return None
+            score = self._scores.get(node[1])
+            return score and (score[0], score[1] - 1)
+        if typ in ('label', 'paren'):
+            return self._score(rule, node[1])
+        if typ == 'post':
+            return _max(self._repetition_score(node),
+                        self._score(rule, node[1]))
+        if typ == 'seq':
+            score = self._own_score(rule, node)
+            for n in node[1]:
+                score = _max(score, self._score(rule, n))
+            return score
+        if typ == 'choice':
+            score = None
+            for n in node[1]:
+                score = _max(score, self._score(rule, n))
+            return score
+        return None
+
+    def _own_score(self, rule, node):
+        # A seq that applies its own rule again is a list, whose items
+        # are everything else in it.
+        others = [n for n in node[1] if _unlabeled(n) != ['apply', rule]]
+        if len(others) == len(node[1]):
+            return None
+        return (self._depth(['seq', others]), 0)
+
+    #
+    # Checking the strings generated.
+    #
+
+    def _matches(self, key, node, text):
+        """Returns whether the node matches all of the text."""
+        interpreter = self._interpreters.get(key)
+        if interpreter is None:
+            # Add a rule for the node to the start of the grammar (leaving
+            # out any annotations, since they only apply to the real
+            # starting rule).
+            name = 'generated'
+            while name in self.grammar.rules:
+                name += '_'
+            rules = [['rule', name, node]] + [n[:3] for n in
+                                              self.grammar.ast[1]]
+            grammar, _ = Analyzer().analyze(['rules', rules])
+            interpreter = Interpreter(grammar, memoize=True)
+            self._interpreters[key] = interpreter
+        try:
+            _, err, pos = interpreter.interpret(text, '<generated>',
+                                                self.global_vars)
+        except Exception:  # pylint: disable=broad-except
+            return False
+        return not err and pos == len(text)
+
+
+def _fixed_point(grammar, values, fn):
+    """Sets values[rule] to fn(rule, node) for each rule, over and over
+    until none of them change."""
+    changed = True
+    while changed:
+        changed = False
+        for rule, node in grammar.rules.items():
+            value = fn(rule, node)
+            if value != values[rule]:
+                values[rule] = value
+                changed = True
+
+
+def _max(s1, s2):
+    if s1 is None:
+        return s2
+    if s2 is None:
+        return s1
+    return max(s1, s2)
+
+
+def _first_element(node):
+    if node[0] == 'seq' and node[1]:
+        return _unlabeled(node[1][0])
+    return _unlabeled(node)
+
+
+def _unlabeled(node):
+    if node[0] == 'label':
+        return node[1]
+    return node
@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import glob
+import mmap
 import os
 import shutil
 import subprocess
@@ -68,6 +70,9 @@ class Host(object):
     def getcwd(self):
         return os.getcwd()
 
+    def glob(self, pattern):
+        return sorted(glob.glob(pattern, recursive=True))
+
     def join(self, *comps):
         return os.path.join(*comps)
 
@@ -77,9 +82,22 @@ class Host(object):
     def mktempfile(self, delete=True):
         return tempfile.NamedTemporaryFile(delete=delete)
 
+    def map_file(self, path):
+        with open(path, 'rb') as f:
+            # Empty files can't be mapped.
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def maybe_mkdir(self, *comps):
+        os.makedirs(self.join(*comps), exist_ok=True)
+
     def mkdtemp(self, **kwargs):
         return tempfile.mkdtemp(**kwargs)
 
+    def open_text_file(self, path):
+        return open(path)
+
     def path_to_host_module(self):
         return _path_to_host_module
 
@@ -88,6 +106,10 @@ class Host(object):
         stream.write(msg + end)
         stream.flush()
 
+    def read_binary_file(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
     def read_text_file(self, path):
         with open(path) as f:
             return f.read()
@@ -12,25 +12,208 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import py_compile
+import tempfile
+
+from glop import analyzer
+from glop import compiler
+from glop import string_literal
 from glop.compiler import Compiler
+from glop.version import VERSION
+
+
+def _source_hash(modules):
+    h = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as fp:
+            h.update(fp.read())
+    return h.hexdigest()
+
+
+# A hash of the code that turns grammars into parsers, so that a change
+# to it doesn't leave parsers it generated before in use.
+_CODEGEN_HASH = _source_hash([analyzer, compiler, string_literal])
+
+# The parser classes that have been compiled (or loaded) in this process,
+# by cache key (see Interpreter.cache_key()).
+_parser_classes = {}
 
 
 class Interpreter(object):
-    def __init__(self, grammar, memoize):
+    def __init__(self, grammar, memoize, memo_limit=None, streaming=False,
+                 binary=False, cache_dir=None, profile=False,
+                 heatmap=False):
         self.memoize = memoize
+        self.memo_limit = memo_limit
+        self.streaming = streaming
+        self.binary = binary
+        self.cache_dir = cache_dir
+        self.profile = profile
+        self.heatmap = heatmap
         self.grammar = grammar
         self.parser_cls = None
 
-    def interpret(self, contents, path, global_vars=None):
+        # When profiling, the stats for each rule (see the generated
+        # parser's profile() method), added up over every input parsed.
+        self.profile_stats = {}
+
+        # When making heatmaps, a (path, heatmap) tuple for each input
+        # parsed (see the generated parser's heatmap() method).
+        self.heatmaps = []
+
+    def interpret(self, contents, path, global_vars=None, jobs=1):
         if not self.parser_cls:
-            scope = {}
-            comp = Compiler(self.grammar, 'Parser', main_wanted=False,
-                            memoize=self.memoize)
-            compiled_text, err = comp.compile()
+            self.parser_cls, err = self._load_parser_cls()
             if err:
-                return None, err, _
-            exec(compiled_text, scope)
-            self.parser_cls = scope['Parser']
+                return None, err, None
 
         parser = self.parser_cls(contents, path)
+        if jobs > 1 and hasattr(parser, 'split_points'):
+            return parse_in_parallel(parser, jobs, global_vars)
+        result = parser.parse(global_vars=global_vars)
+        if self.profile:
+            for rule, stats in parser.profile().items():
+                totals = self.profile_stats.setdefault(rule, {})
+                for k, v in stats.items():
+                    totals[k] = totals.get(k, 0) + v
+        if self.heatmap:
+            self.heatmaps.append((path, parser.heatmap()))
+        return result
+
+    def compile(self):
+        """Returns a (text, err) tuple for the source of the parser."""
+        comp = Compiler(self.grammar, 'Parser', main_wanted=False,
+                        memoize=self.memoize,
+                        memo_limit=self.memo_limit,
+                        streaming=self.streaming,
+                        binary=self.binary,
+                        profile=self.profile,
+                        heatmap=self.heatmap)
+        return comp.compile()
+
+    def cache_key(self):
+        """Returns a hash of everything that affects the compiled parser."""
+        key = json.dumps([VERSION, _CODEGEN_HASH, self.grammar.ast,
+                          self.memoize, self.memo_limit, self.streaming,
+                          self.binary, self.profile, self.heatmap])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _load_parser_cls(self):
+        key = self.cache_key()
+        if key in _parser_classes:
+            return _parser_classes[key], None
+
+        # The compiled modules are cached on disk along with their bytecode
+        # (even if Python wouldn't normally write it), and then imported
+        # normally.
+        path = None
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, 'glop_%s.py' % key)
+        if path and os.path.exists(path):
+            parser_cls = _import(key, path).Parser
+        else:
+            compiled_text, err = self.compile()
+            if err:
+                return None, err
+            if path and _write_atomically(path, compiled_text):
+                parser_cls = _import(key, path).Parser
+            else:
+                scope = {}
+                exec(compiled_text, scope)
+                parser_cls = scope['Parser']
+        _parser_classes[key] = parser_cls
+        return parser_cls, None
+
+
+def parse_in_parallel(parser, jobs, global_vars=None):
+    """Parses the input of a parser generated from a grammar with a 'split'
+    annotation, using up to `jobs` worker processes, and returns the same
+    (val, err, pos) tuple that parser.parse() would.
+
+    The input is split up into several times as many pieces as there are
+    workers, and the workers match the items of the split repetition in
+    each piece (after the first), while this process parses the input
+    from the start. Whenever the repetition gets to the start of a piece,
+    the items the workers found are used rather than matching them again.
+    If a piece doesn't start at the start of an item after all (or a
+    worker fails), the repetition just never gets to it, and the items
+    in it are matched here, one at a time, as they would've been anyway.
+
+    The workers are forked, so that they can share the input (and the
+    parser class) with this process rather than having them pickled, and
+    so the input is just parsed here if forking isn't possible."""
+    points = parser.split_points(jobs * 4)
+    if not points or 'fork' not in multiprocessing.get_all_start_methods():
         return parser.parse(global_vars=global_vars)
+
+    _chunk_parser.update(cls=type(parser), msg=parser.msg,
+                         fname=parser.fname, global_vars=global_vars)
+    executor = concurrent.futures.ProcessPoolExecutor(
+        jobs, mp_context=multiprocessing.get_context('fork'))
+    items = _Items()
+    try:
+        for start, stop in zip(points, points[1:] + [parser.end]):
+            items[start] = executor.submit(_parse_chunk, start, stop)
+        return parser.parse_with_items(items, global_vars=global_vars)
+    finally:
+        # The pieces that haven't been started aren't needed any more.
+        for future in items.values():
+            future.cancel()
+        executor.shutdown()
+        _chunk_parser.clear()
+
+
+# What the worker processes started by parse_in_parallel() parse. This is
+# set before they're forked, so they get it along with everything else.
+_chunk_parser = {}
+
+
+def _parse_chunk(start, stop):
+    parser = _chunk_parser['cls'](_chunk_parser['msg'],
+                                  _chunk_parser['fname'])
+    return parser.parse_items(start, stop, _chunk_parser['global_vars'])
+
+
+class _Items(dict):
+    """Maps positions to futures for the items matched from them, waiting
+    for the futures to finish when they're looked up. Positions where
+    no items could be matched are treated as missing."""
+
+    def __contains__(self, pos):
+        future = self.get(pos)
+        return (future is not None and future.exception() is None and
+                future.result()[1] > pos)
+
+    def __getitem__(self, pos):
+        return super().__getitem__(pos).result()
+
+
+def _import(key, path):
+    spec = importlib.util.spec_from_file_location('glop_%s' % key, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _write_atomically(path, contents):
+    # Other processes may be reading the cache at the same time, so the
+    # file is written under a temporary name and then renamed (and
+    # py_compile writes the bytecode the same way). Returns whether the
+    # file could be written; if not, nothing is cached.
+    dirname = os.path.dirname(path)
+    try:
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(contents)
+        os.replace(tmp_path, path)
+        py_compile.compile(path, doraise=True)
+        return True
+    except (OSError, py_compile.PyCompileError):
+        return False
@@ -27,7 +27,17 @@ class Printer(object):
         rules = []
         max_rule_len = 0
         max_choice_len = 0
-        for rule_name, node in self.grammar.rules.items():
+        # The rules are printed as written, rather than as the Analyzer
+        # may have rewritten them.
+        for rule in self.grammar.ast[1]:
+            rule_name, node = rule[1], rule[2]
+            if rule_name in self.grammar.memo_annotations:
+                rule_name = '%s (%s)' % (
+                    rule_name, self.grammar.memo_annotations[rule_name])
+            elif rule_name in self.grammar.split_annotations:
+                rule_name = '%s (split %s)' % (
+                    rule_name,
+                    self._proc(self.grammar.split_annotations[rule_name]))
             cs = []
             max_rule_len = max(len(rule_name), max_rule_len)
             single_line_str = self._proc(node)
@@ -78,6 +88,9 @@ class Printer(object):
     def _choice_(self, node):
         return ' | '.join(self._proc(e) for e in node[1])
 
+    def _cut_(self, node):
+        return '^'
+
     def _empty_(self, node):
         return ''
 
@@ -59,3 +59,19 @@ def encode(s):
     else:
         return (prefix + squote +
                 ''.join(_enc(ch, esc_dquote=False) for ch in s) + squote)
+
+
+def encode_bytes(s):
+    """Returns a bytes literal for `s`, mapping each character to the
+    byte with the same value; raises ValueError if one doesn't fit."""
+    if any(ord(ch) > 255 for ch in s):
+        raise ValueError('%s can not be matched as bytes' % encode(s))
+    squote = "'"
+    dquote = '"'
+    has_squote = any(ch == "'" for ch in s)
+    if has_squote:
+        return ('b' + dquote +
+                ''.join(_enc(ch, esc_dquote=True) for ch in s) + dquote)
+    else:
+        return ('b' + squote +
+                ''.join(_enc(ch, esc_dquote=False) for ch in s) + squote)
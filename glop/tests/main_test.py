@@ -12,14 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
+import json
+import mmap
+import os
 import sys
 import unittest
 
 if sys.version_info[0] >= 3:
     unicode = str
 
+from glop import interpreter
+from glop.analyzer import Analyzer
 from glop.fakes.host_fake import FakeHost
 from glop.host import Host
+from glop.parser import Parser
 from glop.tool import main, VERSION
 
 
@@ -30,6 +37,8 @@ SIMPLE_GRAMMAR = "grammar = anything*:as end -> ''.join(as) ,"
 class CheckMixin(object):
     def _write_files(self, host, files):
         for path, contents in list(files.items()):
+            if host.dirname(path):
+                host.maybe_mkdir(host.dirname(path))
             host.write_text_file(path, contents)
 
     def _read_files(self, host, tmpdir):
@@ -164,6 +173,621 @@ class TestMain(UnitTestMixin, CheckMixin, unittest.TestCase):
                        files=files, returncode=0, out='', err='',
                        output_files=out_files)
 
+    def test_memo_stats(self):
+        grammar = ("grammar (memo) = (pair | one)*:vs end -> vs\n"
+                   "pair = item:x ',' item:y -> [x, y]\n"
+                   "one = item\n"
+                   "item = 'a' -> 'a'\n")
+        host = self._host()
+        try:
+            tmpdir = host.mkdtemp()
+            grammar_path = host.join(tmpdir, 'grammar.g')
+            parser_path = host.join(tmpdir, 'parser.py')
+            for contents, args, stats, evictions in (
+                    (grammar, ['--memoize'], {'grammar': 1, 'item': 3},
+                     {'grammar': 0, 'item': 0}),
+                    (grammar.replace('item =', 'item (nomemo) ='),
+                     ['--memoize'], {'grammar': 1}, {'grammar': 0}),
+                    (grammar, ['--no-memoize'], {}, {}),
+                    (grammar, ['--memo-limit', '1'], {'grammar': 1, 'item': 0},
+                     {'grammar': 0, 'item': 3})):
+                host.write_text_file(grammar_path, contents)
+                self._call(host, ['-c', '-o', parser_path, grammar_path] +
+                           args, returncode=0, out='', err='')
+                scope = {}
+                exec(host.read_text_file(parser_path), scope)
+                parser = scope['Parser']('a,aa', 'input.txt')
+                self.assertEqual(parser.parse(),
+                                 ([['a', 'a'], 'a'], None, 4))
+                self.assertEqual(parser.memo_stats(), stats)
+                self.assertEqual(parser.memo_evictions(), evictions)
+        finally:
+            host.rmtree(tmpdir)
+
+    def test_profile(self):
+        grammar = ("grammar (memo) = (pair | one)*:vs end -> vs\n"
+                   "pair = item:x ',' item:y -> [x, y]\n"
+                   "one = item\n"
+                   "item = 'a' -> 'a'\n")
+        host = self._host()
+        try:
+            tmpdir = host.mkdtemp()
+            grammar_path = host.join(tmpdir, 'grammar.g')
+            input_path = host.join(tmpdir, 'input.txt')
+            profile_path = host.join(tmpdir, 'profile.json')
+            host.write_text_file(grammar_path, grammar)
+            host.write_text_file(input_path, 'a,aa')
+            _, _, err = self._call(host, ['--profile-json', profile_path,
+                                          '-i', input_path, grammar_path],
+                                   returncode=0)
+            self.assertEqual(err.splitlines()[0].split(),
+                             ['rule', 'calls', 'time', '(s)', 'self', '(s)',
+                              'backtracks', 'memo', 'hits'])
+            self.assertEqual(sorted(line.split()[0]
+                                    for line in err.splitlines()[1:]),
+                             ['grammar', 'item', 'one', 'pair'])
+
+            stats = json.loads(host.read_text_file(profile_path))
+            for rule in stats.values():
+                self.assertGreaterEqual(rule.pop('time'),
+                                        rule.pop('self_time'))
+            self.assertEqual(stats, {
+                'grammar': {'calls': 1, 'backtracks': 0, 'memo_hits': 0,
+                            'memo_misses': 1},
+                'pair': {'calls': 2, 'backtracks': 1},
+                'one': {'calls': 1, 'backtracks': 0},
+                'item': {'calls': 4, 'backtracks': 0, 'memo_hits': 1,
+                         'memo_misses': 3}})
+        finally:
+            host.rmtree(tmpdir)
+
+        self.check_cmd(['--profile', '-j', '2', 'grammar.g'],
+                       files={'grammar.g': grammar}, returncode=2,
+                       err='Error: --profile can not be used with -j\n')
+
+    def test_heatmap(self):
+        files = {
+            'grammar.g': ("grammar = (pair | one)*:vs end -> vs\n"
+                          "pair = item:x ',' item:y -> [x, y]\n"
+                          "one = item\n"
+                          "item = 'a' -> 'a'\n"),
+            'input.txt': 'a,aa',
+        }
+        _, _, err = self.check_cmd(['--heatmap', '--no-memoize', '-i',
+                                    'input.txt', 'grammar.g'],
+                                   files=files, returncode=0)
+        lines = err.splitlines()
+        self.assertEqual(lines[0],
+                         'input.txt: 2.00 rule attempts per character')
+        self.assertEqual(lines[1].split(),
+                         ['rule', 'line', 'column', 'attempts', 'stack'])
+        self.assertEqual(lines[2].split(),
+                         ['item', '1', '4', '2', 'grammar', '>', 'one'])
+
+        # Results found in the memo cache don't count.
+        _, _, err = self.check_cmd(['--heatmap', '-i', 'input.txt',
+                                    'grammar.g'], files=files, returncode=0)
+        self.assertEqual(err.splitlines()[2].split(),
+                         ['grammar', '1', '1', '1', '-'])
+
+    def test_generate(self):
+        grammar = ("grammar = value:v end -> v\n"
+                   "value  = '[' list:vs ']' -> vs\n"
+                   "       | ('a'..'z')+:cs ~'a'..'z' -> ''.join(cs)\n"
+                   "list   = value:v ',' list:vs -> [v] + vs\n"
+                   "       | value:v -> [v]\n")
+        host = self._host()
+        try:
+            tmpdir = host.mkdtemp()
+            grammar_path = host.join(tmpdir, 'grammar.g')
+            input_path = host.join(tmpdir, 'input.txt')
+            host.write_text_file(grammar_path, grammar)
+            _, out, _ = self._call(host, ['--generate', '500', '--seed', '1',
+                                          grammar_path], returncode=0, err='')
+            self.assertGreaterEqual(len(out), 500)
+
+            host.write_text_file(input_path, out)
+            self._call(host, ['-i', input_path, grammar_path], returncode=0)
+
+            # Inputs smaller than an item are grown too.
+            _, small, _ = self._call(host, ['--generate', '10', '--seed',
+                                            '1', grammar_path],
+                                     returncode=0, err='')
+            self.assertGreaterEqual(len(small), 10)
+        finally:
+            host.rmtree(tmpdir)
+
+        # The same seed gives the same input.
+        files = {'grammar.g': grammar}
+        _, out2, _ = self.check_cmd(['--generate', '500', '--seed', '1',
+                                     'grammar.g'], files=files, returncode=0)
+        self.assertEqual(out, out2)
+
+    def test_incremental(self):
+        host = self._host()
+        try:
+            tmpdir = host.mkdtemp()
+            grammar_path = host.join(tmpdir, 'grammar.g')
+            parser_path = host.join(tmpdir, 'parser.py')
+            host.write_text_file(grammar_path,
+                                 "grammar = item*:is end -> is\n"
+                                 "item = ('a'..'z')+:cs ';' -> cat(cs)\n")
+            self._call(host, ['-c', '--incremental', '-o', parser_path,
+                              grammar_path],
+                       returncode=0, out='', err='')
+            scope = {}
+            exec(host.read_text_file(parser_path), scope)
+            parser = scope['Parser']('ab;cd;ef;', 'input.txt')
+            self.assertEqual(parser.parse(), (['ab', 'cd', 'ef'], None, 9))
+            self.assertEqual(parser.memo_stats(), {'item': 4})
+
+            # Only the edited item is reparsed; the results for the others
+            # are reused (and moved along with their text).
+            self.assertEqual(parser.reparse(4, 4, 'xy;z'),
+                             (['ab', 'cxy', 'zd', 'ef'], None, 13))
+            self.assertEqual(parser.memo_stats(), {'item': 5})
+
+            self.assertEqual(parser.reparse(12, 13, ''),
+                             (None, 'input.txt:1 Unexpected end of input at '
+                                    'column 13', 12))
+            self.assertEqual(parser.reparse(3, 3, '!'),
+                             (None, 'input.txt:1 Unexpected "!" at column 4',
+                              3))
+            self.assertEqual(parser.reparse(3, 4, ''),
+                             (None, 'input.txt:1 Unexpected end of input at '
+                                    'column 13', 12))
+
+            self._call(host, ['-c', '--incremental', '--memo-limit', '1',
+                              '-o', parser_path, grammar_path],
+                       returncode=1, out='',
+                       err='memo limits can not be used with incremental '
+                           'parsing\n')
+        finally:
+            host.rmtree(tmpdir)
+
+    def test_incremental_lookahead(self):
+        # Edits to the text that a result looked at past its end, e.g.
+        # in the last, failing, iteration of a repetition, invalidate it.
+        host = self._host()
+        try:
+            tmpdir = host.mkdtemp()
+            grammar_path = host.join(tmpdir, 'grammar.g')
+            parser_path = host.join(tmpdir, 'parser.py')
+            host.write_text_file(grammar_path,
+                                 "grammar = item:i anything*:cs end"
+                                 " -> [i, cat(cs)]\n"
+                                 "item = 'x':x skip -> x\n"
+                                 "skip = ('x' | 'a' 'c' | 'b' ~'d')*\n")
+            self._call(host, ['-c', '--incremental', '-o', parser_path,
+                              grammar_path],
+                       returncode=0, out='', err='')
+            scope = {}
+            exec(host.read_text_file(parser_path), scope)
+            parser = scope['Parser']('xxab', 'input.txt')
+            self.assertEqual(parser.parse(), (['x', 'ab'], None, 4))
+            self.assertEqual(parser.reparse(3, 4, 'c'), (['x', ''], None, 4))
+
+            parser = scope['Parser']('xxbd', 'input.txt')
+            self.assertEqual(parser.parse(), (['x', 'bd'], None, 4))
+            self.assertEqual(parser.reparse(3, 4, 'e'), (['x', 'e'], None, 4))
+        finally:
+            host.rmtree(tmpdir)
+
+    def test_left_recursion(self):
+        grammar = ("grammar = sum:s end -> s\n"
+                   "sum = sum:s '+' num:n -> [s, n] | num\n"
+                   "num = '0'..'9'\n")
+        host = self._host()
+        try:
+            tmpdir = host.mkdtemp()
+            grammar_path = host.join(tmpdir, 'grammar.g')
+            parser_path = host.join(tmpdir, 'parser.py')
+            host.write_text_file(grammar_path, grammar)
+
+            # Left-recursive rules are grown in the memo cache, so they
+            # have to be memoized even when nothing else is.
+            self._call(host, ['-c', '--no-memoize', '-o', parser_path,
+                              grammar_path],
+                       returncode=0, out='', err='')
+            scope = {}
+            exec(host.read_text_file(parser_path), scope)
+            parser = scope['Parser']('1+2+3', 'input.txt')
+            self.assertEqual(parser.parse(), ([['1', '2'], '3'], None, 5))
+            self.assertEqual(parser.memo_stats(), {'sum': 1})
+
+            self._call(host, ['-c', '--incremental', '-o', parser_path,
+                              grammar_path],
+                       returncode=0, out='', err='')
+            scope = {}
+            exec(host.read_text_file(parser_path), scope)
+            parser = scope['Parser']('1+2+3', 'input.txt')
+            self.assertEqual(parser.parse(), ([['1', '2'], '3'], None, 5))
+            self.assertEqual(parser.reparse(4, 4, '4+'),
+                             ([[['1', '2'], '4'], '3'], None, 7))
+            self.assertEqual(parser.reparse(1, 2, ''),
+                             (None, 'input.txt:1 Unexpected "2" at column 2',
+                              1))
+        finally:
+            host.rmtree(tmpdir)
+
+    def test_left_recursion_with_memo_limit(self):
+        # Seeds that are still growing aren't evicted, even when there are
+        # more of them than the limit.
+        grammar = ("grammar = e:v end -> v\n"
+                   "e = e:a '+' t:b -> [a, '+', b]\n"
+                   "  | ?(true) e:a '-' t:b -> [a, '-', b]\n"
+                   "  | t\n"
+                   "t = '(' e:x ')' -> x | '0'..'9'\n")
+        for limit, text in (('1', '1+(2'), ('2', '1+((2'), ('3', '1+(((2')):
+            files = {'grammar.g': grammar, 'input.txt': text}
+            self.check_cmd(['--memo-limit', limit, '-i', 'input.txt',
+                            'grammar.g'], files=files, returncode=1,
+                           err='input.txt:1 Unexpected end of input at '
+                               'column %d\n' % (len(text) + 1))
+            files['input.txt'] = text + ')' * text.count('(')
+            self.check_cmd(['--memo-limit', limit, '-i', 'input.txt',
+                            'grammar.g'], files=files, returncode=0,
+                           out='[\n  "1",\n  "+",\n  "2"\n]')
+
+    def test_stream(self):
+        files = {
+            'simple.g': SIMPLE_GRAMMAR,
+            'input.txt': 'hello, world\n',
+        }
+        self.check_cmd(['--stream', 'simple.g'], stdin="hello, world\n",
+                       files=files, returncode=0, out="hello, world\n", err='')
+        self.check_cmd(['--stream', '-i', 'input.txt', 'simple.g'],
+                       files=files, returncode=0, out="hello, world\n", err='')
+
+        host = self._host()
+        try:
+            tmpdir = host.mkdtemp()
+            grammar_path = host.join(tmpdir, 'grammar.g')
+            parser_path = host.join(tmpdir, 'parser.py')
+            host.write_text_file(grammar_path,
+                                 "grammar = line*:ls end -> ls\n"
+                                 "line = ('a'..'z')*:cs '\\n' -> cat(cs)\n")
+            self._call(host, ['-c', '--stream', '-o', parser_path,
+                              grammar_path],
+                       returncode=0, out='', err='')
+            scope = {}
+            exec(host.read_text_file(parser_path), scope)
+
+            # The text before each line is thrown away once the line has
+            # been parsed, but errors are still reported correctly.
+            msg = 'ab\ncd\n' * 10 + 'ef\ng!\n'
+            parser = scope['Parser'](iter(msg), 'input.txt')
+            self.assertEqual(parser.parse(),
+                             (None, 'input.txt:22 Unexpected "!" at column 2',
+                              len(msg) - 2))
+            self.assertLess(len(parser.msg), 10)
+
+            msg = 'ab\ncd\n' * 10
+            parser = scope['Parser'](iter(msg), 'input.txt')
+            self.assertEqual(parser.parse(), (['ab', 'cd'] * 10, None, 60))
+            self.assertEqual(parser.msg, '')
+        finally:
+            host.rmtree(tmpdir)
+
+    def test_mmap(self):
+        files = {
+            'simple.g': SIMPLE_GRAMMAR,
+            'input.txt': 'héllo, wörld\n',
+            'empty.txt': '',
+        }
+        self.check_cmd(['--mmap', '-i', 'input.txt', 'simple.g'],
+                       files=files, returncode=0,
+                       out='héllo, wörld\n', err='')
+        self.check_cmd(['--mmap', '-i', 'empty.txt', 'simple.g'],
+                       files=files, returncode=0, out='', err='')
+
+        host = self._host()
+        try:
+            tmpdir = host.mkdtemp()
+            grammar_path = host.join(tmpdir, 'grammar.g')
+            parser_path = host.join(tmpdir, 'parser.py')
+            host.write_text_file(grammar_path, SIMPLE_GRAMMAR)
+            self._call(host, ['-c', '--mmap', '-o', parser_path,
+                              grammar_path],
+                       returncode=0, out='', err='')
+            scope = {}
+            exec(host.read_text_file(parser_path), scope)
+
+            # Characters can be split across chunks of bytes.
+            msg = 'héllo\n'.encode('utf-8')
+            parser = scope['Parser'](iter([msg[:2], msg[2:]]), 'input.txt')
+            self.assertEqual(parser.parse(), ('héllo\n', None, 6))
+        finally:
+            host.rmtree(tmpdir)
+
+        # Actually mapping a file needs a real one.
+        host = Host()
+        try:
+            tmpdir = host.mkdtemp()
+            input_path = host.join(tmpdir, 'input.txt')
+            with open(input_path, 'wb') as f:
+                f.write(msg * 1000)
+            with open(input_path, 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    parser = scope['Parser'](m, input_path)
+                    self.assertEqual(parser.parse(),
+                                     ('héllo\n' * 1000, None, 6000))
+                finally:
+                    m.close()
+
+            out = io.StringIO()
+            self.assertEqual(scope['main'](['--mmap', input_path],
+                                           stdout=out), 0)
+            self.assertEqual(out.getvalue(),
+                             json.dumps('héllo\n' * 1000) + '\n')
+        finally:
+            host.rmtree(tmpdir)
+
+    def test_bytes(self):
+        files = {
+            'cat.g': "grammar = anything*:bs end -> cat(bs)",
+            'wide.g': "grammar = 'a'..'\\u0100'",
+            'input.txt': 'héllo, wörld\n',
+        }
+        self.check_cmd(['--bytes', '-i', 'input.txt', 'cat.g'],
+                       files=files, returncode=0,
+                       out='héllo, wörld\n', err='')
+        self.check_cmd(['--bytes', '--mmap', '-i', 'input.txt', 'cat.g'],
+                       files=files, returncode=0,
+                       out='héllo, wörld\n', err='')
+        self.check_cmd(['--bytes', '--stream', '-i', 'input.txt', 'cat.g'],
+                       files=files, returncode=1,
+                       err='streaming can not be used with bytes input\n')
+        self.check_cmd(['-c', '--bytes', 'wide.g'], files=files,
+                       returncode=1,
+                       err="u'\\u0100' can not be matched as bytes\n")
+
+        host = self._host()
+        try:
+            tmpdir = host.mkdtemp()
+            grammar_path = host.join(tmpdir, 'grammar.g')
+            parser_path = host.join(tmpdir, 'parser.py')
+            host.write_text_file(grammar_path,
+                                 "grammar = field*:fs end -> fs\n"
+                                 "field = 'x' hex:h -> xtoi(h)\n"
+                                 "      | ('\\x80'..'\\xff')+:bs -> cat(bs)\n"
+                                 "      | ('a'..'z' | '\\n')+:cs -> cat(cs)\n"
+                                 "hex = ('0'..'9'|'a'..'f')+:ds -> cat(ds)\n")
+            self._call(host, ['-c', '--bytes', '-o', parser_path,
+                              grammar_path],
+                       returncode=0, out='', err='')
+            scope = {}
+            exec(host.read_text_file(parser_path), scope)
+
+            # The characters in the grammar match the bytes with the same
+            # values, whatever the input's encoding is.
+            msg = b'x1f\xe9\xffab\nc'
+            for m in (msg, bytearray(msg), memoryview(msg)):
+                self.assertEqual(scope['Parser'](m, 'input.bin').parse(),
+                                 ([31, b'\xe9\xff', b'ab\nc'], None, 9))
+            self.assertEqual(scope['Parser'](b'ab\nc!', 'input.bin').parse(),
+                             (None, 'input.bin:2 Unexpected "!" at column 2',
+                              4))
+        finally:
+            host.rmtree(tmpdir)
+
+    def test_bytes_ninja(self):
+        # Strings in the actions are bytes too, so that joining them with
+        # the bytes matched works.
+        h = Host()
+        ninja_g = h.read_text_file(
+            h.join(h.dirname(h.path_to_host_module()), '..',
+                   'grammars', 'ninja.g'))
+        files = {
+            'ninja.g': ninja_g,
+            'build.ninja': ('cflags = -O2\n'
+                            'rule cc\n'
+                            '  command = gcc $cflags -c $in -o $out\n'
+                            '\n'
+                            'build foo.o: cc foo.c\n'),
+        }
+        _, out, _ = self.check_cmd(['--bytes', '-i', 'build.ninja',
+                                    'ninja.g'], files=files, returncode=0,
+                                   err='')
+        self.assertEqual(json.loads(out), [
+            ['var', 'cflags', '-O2'],
+            ['rule', 'cc',
+             [['var', 'command', 'gcc $cflags -c $in -o $out']]],
+            ['build', ['foo.o'], 'cc', ['foo.c'], [], [], []]])
+
+    def test_pos_to_line_col(self):
+        host = self._host()
+        try:
+            tmpdir = host.mkdtemp()
+            grammar_path = host.join(tmpdir, 'grammar.g')
+            parser_path = host.join(tmpdir, 'parser.py')
+            host.write_text_file(grammar_path,
+                                 "grammar = line*:ls end -> ls\n"
+                                 "line = ('a'..'z')*:cs '\\n' -> cat(cs)\n")
+            for args, msg in ((['--incremental'], 'ab\ncd\n\nef\n'),
+                              (['--bytes'], b'ab\ncd\n\nef\n'),
+                              (['--stream'], 'ab\ncd\n\nef\n')):
+                self._call(host, ['-c', '-o', parser_path, grammar_path] +
+                           args, returncode=0, out='', err='')
+                scope = {}
+                exec(host.read_text_file(parser_path), scope)
+                parser = scope['Parser'](msg, 'input.txt')
+                self.assertEqual([parser.pos_to_line_col(p)
+                                  for p in (8, 0, 2, 3, 6, 10)],
+                                 [(4, 2), (1, 1), (1, 3), (2, 1), (3, 1),
+                                  (5, 1)])
+
+            # When streaming, the text before the last line parsed has been
+            # thrown away.
+            parser.parse()
+            self.assertEqual(parser.pos_to_line_col(10), (5, 1))
+            self.assertRaises(ValueError, parser.pos_to_line_col, 0)
+
+            # The lines after an edit are found again.
+            self._call(host, ['-c', '--incremental', '-o', parser_path,
+                              grammar_path], returncode=0, out='', err='')
+            scope = {}
+            exec(host.read_text_file(parser_path), scope)
+            parser = scope['Parser']('ab\ncd\n', 'input.txt')
+            self.assertEqual(parser.pos_to_line_col(6), (3, 1))
+            self.assertEqual(parser.reparse(1, 1, '\n\n!'),
+                             (None, 'input.txt:3 Unexpected "!" at column 1',
+                              3))
+            self.assertEqual(parser.pos_to_line_col(9), (5, 1))
+        finally:
+            host.rmtree(tmpdir)
+
+    def test_cache_dir(self):
+        # The compiled parsers are always cached on the real filesystem.
+        real_host = Host()
+        cache_dir = real_host.mkdtemp()
+        try:
+            files = {
+                'simple.g': SIMPLE_GRAMMAR,
+                'input.txt': 'hello, world\n',
+            }
+            args = ['--cache-dir', cache_dir, '-i', 'input.txt', 'simple.g']
+            mtimes = []
+            for _ in range(2):
+                interpreter._parser_classes.clear()
+                self.check_cmd(args, files=files, returncode=0,
+                               out='hello, world\n', err='')
+                mtimes.append({
+                    f: os.stat(real_host.join(cache_dir, f)).st_mtime_ns
+                    for f in real_host.files_under(cache_dir)})
+            self.assertEqual(sorted(f.endswith('.pyc') for f in mtimes[0]),
+                             [False, True])
+            self.assertEqual(mtimes[0], mtimes[1])
+
+            self.check_cmd(args + ['--no-memoize'], files=files,
+                           returncode=0, out='hello, world\n', err='')
+            self.assertEqual(len(real_host.files_under(cache_dir)), 4)
+        finally:
+            real_host.rmtree(cache_dir)
+
+        # Parsers generated by a different compiler aren't reused.
+        ast, _, _ = Parser(SIMPLE_GRAMMAR, 'simple.g').parse()
+        grammar, _ = Analyzer().analyze(ast)
+        key = interpreter.Interpreter(grammar, memoize=True).cache_key()
+        codegen_hash = interpreter._CODEGEN_HASH
+        try:
+            interpreter._CODEGEN_HASH = 'changed'
+            self.assertNotEqual(
+                interpreter.Interpreter(grammar, memoize=True).cache_key(),
+                key)
+        finally:
+            interpreter._CODEGEN_HASH = codegen_hash
+
+    def test_batch(self):
+        files = {
+            'simple.g': "grammar = ('a'..'z')*:cs end -> cat(cs)",
+            'in/a.txt': 'abc',
+            'in/sub/b.txt': 'de!',
+            'in/c.txt': 'fg',
+            'list.txt': 'in/c.txt\nin/a.txt\n',
+        }
+        self.check_cmd(['-i', 'in/*.txt', 'simple.g'], files=files,
+                       returncode=0, err='',
+                       out='{"path": "in/a.txt", "value": "abc"}\n'
+                           '{"path": "in/c.txt", "value": "fg"}\n')
+        self.check_cmd(['-i', 'in/*.json', 'simple.g'], files=files,
+                       returncode=1, out='',
+                       err='Error: no files match "in/*.json"\n')
+        self.check_cmd(['--files-from', 'list.txt', '-i', 'missing.txt',
+                        'simple.g'], files=files, returncode=1, err='',
+                       out='{"path": "missing.txt", "error": "Error: no '
+                           'such file: \\"missing.txt\\""}\n'
+                           '{"path": "in/c.txt", "value": "fg"}\n'
+                           '{"path": "in/a.txt", "value": "abc"}\n')
+
+        out_files = files.copy()
+        out_files['out/a.txt'] = 'abc'
+        out_files['out/c.txt'] = 'fg'
+        self.check_cmd(['-r', 'in', '--output-dir', 'out', 'simple.g'],
+                       files=files, returncode=1, out='',
+                       err='in/sub/b.txt:1 Unexpected "!" at column 3\n',
+                       output_files=out_files)
+
+        # The results for paths that go up a directory are written under
+        # their base names, which mustn't clash.
+        self.check_cmd(['-i', 'in/sub/../a.txt', '-i', 'in/sub/../c.txt',
+                        '--output-dir', 'out', 'simple.g'],
+                       files=files, returncode=0, out='', err='',
+                       output_files=out_files)
+        files['in/sub/a.txt'] = 'xyz'
+        self.check_cmd(['-i', 'in/sub/../a.txt', '-i', 'in/sub/a.txt',
+                        '-i', 'in/sub/../sub/a.txt', '--output-dir', 'out',
+                        'simple.g'], files=files, returncode=1, out='',
+                       err='Error: "in/sub/../a.txt" and '
+                           '"in/sub/../sub/a.txt" would both be written '
+                           'to "out/a.txt"\n')
+
+    def test_batch_jobs(self):
+        files = {'simple.g': "grammar = ('a'..'z')*:cs end -> cat(cs)"}
+        expected = ''
+        for i in range(20):
+            files['in/%02d.txt' % i] = 'abc' if i != 5 else 'ab!'
+            if i == 5:
+                expected += ('{"path": "in/05.txt", "error": "in/05.txt:1 '
+                             'Unexpected \\"!\\" at column 3"}\n')
+            else:
+                expected += '{"path": "in/%02d.txt", "value": "abc"}\n' % i
+        self.check_cmd(['-j', '3', '-i', 'in/*.txt', 'simple.g'],
+                       files=files, returncode=1, out=expected, err='')
+        _, out, _ = self.check_cmd(['-j', '3', '--unordered', '-i',
+                                    'in/*.txt', 'simple.g'],
+                                   files=files, returncode=1, err='')
+        self.assertEqual(sorted(out.splitlines()),
+                         sorted(expected.splitlines()))
+
+        # stdin is still read by the main process.
+        self.check_cmd(['-j', '2', '-i', 'in/00.txt', '-i', '-', 'simple.g'],
+                       stdin='xyz', files=files, returncode=0, err='',
+                       out='{"path": "in/00.txt", "value": "abc"}\n'
+                           '{"path": "-", "value": "xyz"}\n')
+
+        self.check_cmd(['-j', '0', 'simple.g'], files=files, returncode=2,
+                       err='Error: the number of jobs must be at least 1\n')
+
+    def test_split(self):
+        grammar = ("grammar (split '\\n' ~' ') = (line | block)*:ls\n"
+                   "    '\\n'* end -> ls\n"
+                   "line = name:n '\\n' -> n\n"
+                   "block = name:n ':\\n' (' ' line)*:ms -> [n, ms]\n"
+                   "name = ('a'..'z' | '0'..'9')+:cs -> cat(cs)\n")
+        files = {'split.g': grammar}
+        expected = []
+        lines = []
+        for i in range(200):
+            if i % 3:
+                expected.append('l%d' % i)
+                lines.append('l%d' % i)
+            else:
+                expected.append(['b%d' % i, ['x', 'y']])
+                lines.extend(['b%d:' % i, ' x', ' y'])
+        files['input.txt'] = '\n'.join(lines) + '\n'
+        _, out, _ = self.check_cmd(['-j', '3', '-i', 'input.txt', 'split.g'],
+                                   files=files, returncode=0, err='')
+        self.assertEqual(json.loads(out), expected)
+
+        # Errors are reported the same way as when parsing sequentially.
+        lines[253] = 'l!'
+        files['input.txt'] = '\n'.join(lines) + '\n'
+        self.check_cmd(['-j', '3', '-i', 'input.txt', 'split.g'],
+                       files=files, returncode=1, out='',
+                       err='input.txt:254 Unexpected "!" at column 2\n')
+
+        _, out, _ = self.check_cmd(['-p', 'split.g'], files=files,
+                                   returncode=0, err='')
+        self.assertTrue(out.startswith("grammar (split '\\n' ~' ') ="))
+        files['split.g'] = grammar.replace("(split '\\n' ~' ') ", '').replace(
+            'line =', "line (split '\\n') =")
+        self.check_cmd(['-i', 'input.txt', 'split.g'], files=files,
+                       returncode=1, out='',
+                       err='"line" can not be split, since it is not the '
+                           'starting rule\n')
+
     def test_no_grammar(self):
         self.check_cmd([], returncode=2)
 
@@ -188,6 +812,38 @@ class TestMain(UnitTestMixin, CheckMixin, unittest.TestCase):
                        out="grammar = anything*:as end -> ''.join(as)\n",
                        output_files=out_files)
 
+    def test_pretty_print_rewritten_rules(self):
+        # Rules are printed (and dumped) as written, not as rewritten.
+        files = {
+            'list.g': "grammar = 'x':x ',' grammar:xs -> [x] + xs\n"
+                      "        | 'x':x -> [x],\n",
+        }
+        self.check_cmd(['-p', 'list.g'], files=files,
+                       returncode=0,
+                       out=("grammar = 'x':x ',' grammar:xs -> [x] + xs\n"
+                            "        | 'x':x                -> [x]\n"))
+        _, out, _ = self.check_cmd(['-a', 'list.g'], files=files,
+                                   returncode=0, err='')
+        self.assertNotIn('xs_0', out)
+
+    def test_pretty_print_factored_rules(self):
+        files = {
+            'factored.g': "grammar = 'a' 'b':x -> x | 'a' 'c':y -> y,\n",
+        }
+        self.check_cmd(['-p', 'factored.g'], files=files,
+                       returncode=0,
+                       out="grammar = 'a' 'b':x -> x | 'a' 'c':y -> y\n")
+
+    def test_pretty_print_memo_annotations(self):
+        files = {
+            'memo.g': "grammar (memo) = foo,\nfoo ( nomemo )= 'x',\n",
+        }
+        self.check_cmd(['-p', 'memo.g'], files=files,
+                       returncode=0,
+                       out=("grammar (memo) = foo\n"
+                            "\n"
+                            "foo (nomemo)   = 'x'\n"))
+
     def test_parse_bad_grammar(self):
         files = {
             'bad.g': 'grammar',
@@ -241,11 +897,126 @@ class TestInterpreter(UnitTestMixin, CheckMixin, unittest.TestCase):
             bar     = 'bar' ,
             """, 'foo')
 
+    def test_empty_alternative(self):
+        self.check_match("grammar = ('a' | ) end -> 'ok' ,", '', out='ok')
+        self.check_match("grammar = ('a' | ) end -> 'ok' ,", 'a', out='ok')
+
+    def test_nested_labels(self):
+        g = """grammar = item:i (',' item)*:is end -> join(',', [i] + is) ,
+               item    = ('a' | 'b')+:cs ~'c'      -> join('', cs) ,"""
+        self.check_match(g, 'a,bb,ab', out='a,bb,ab')
+        self.check_match(g, 'a,bc', returncode=1)
+
     def test_not(self):
         g = """grammar = '"' (~'"' anything)*:as '"' end -> ''.join(as) ,"""
         self.check_match(g, '""')
         self.check_match(g, '"hello"', out='hello')
 
+    def test_char_classes(self):
+        g = """grammar = (id_start | digit)+:cs end -> cat(cs) ,
+               id_start = 'a'..'z' | 'A'..'Z' | '_' ,
+               digit    = '0'..'9' ,"""
+        self.check_match(g, 'a_Z09', out='a_Z09')
+        _, _, err = self.check_match(g, 'ab-', returncode=1)
+        self.assertIn('Unexpected "-" at column 3', err)
+
+        # Big classes are matched with regexps instead of sets.
+        g = "grammar = ('\\u0100'..'\\uffff' | 'x')+:cs end -> cat(cs) ,"
+        self.check_match(g, 'x\u0101x', out='x\u0101x')
+        self.check_match(g, 'xy', returncode=1)
+
+    def test_runs(self):
+        g = """grammar = '/*' (~'*/' anything)*:cs '*/' end -> cat(cs) ,"""
+        self.check_match(g, '/* a * b */', out=' a * b ')
+        _, _, err = self.check_match(g, '/* a', returncode=1)
+        self.assertIn('Unexpected end of input at column 5', err)
+
+        g = """grammar = ws 'x' ws end -> 'ok' ,
+               ws      = (' ' | '$' '\\n')* ,"""
+        self.check_match(g, ' $\n x $\n', out='ok')
+        _, _, err = self.check_match(g, ' $ x', returncode=1)
+        self.assertIn('Unexpected " " at column 3', err)
+
+    def test_cut(self):
+        g = """grammar = stmt:s end          -> s ,
+               stmt    = 'let' ^ ' ' id:i  -> ['let', i]
+                       | id:i              -> ['expr', i] ,
+               id      = ('a'..'z')+:cs    -> cat(cs) ,"""
+        self.check_match(g, 'let x', out='[\n  "let",\n  "x"\n]')
+        self.check_match(g, 'letx', returncode=1)
+        self.check_match(g, 'lex', out='[\n  "expr",\n  "lex"\n]')
+
+        g = """grammar = 'x' (',' ^ 'x')*:xs ','? end -> 'ok' ,"""
+        self.check_match(g, 'x,x,x', out='ok')
+        _, _, err = self.check_match(g, 'x,x,', returncode=1)
+        self.assertIn('Unexpected end of input at column 5', err)
+
+        g = """grammar = ('x' ^ 'y')?:xs 'x' end -> 'ok' ,"""
+        self.check_match(g, 'xyx', out='ok')
+        self.check_match(g, 'x', returncode=1)
+
+    def test_left_recursion(self):
+        g = """grammar = expr:e end                    -> e ,
+               expr    = expr:e '-' term:t          -> '(' + e + '-' + t + ')'
+                       | term ,
+               term    = term:t '*' num:n           -> '(' + t + '*' + n + ')'
+                       | num ,
+               num     = '0'..'9' ,"""
+        self.check_match(g, '1-2*3*4-5', out='((1-((2*3)*4))-5)')
+        self.check_match(g, '7', out='7')
+        _, _, err = self.check_match(g, '1-2*', returncode=1)
+        self.assertIn('Unexpected end of input at column 5', err)
+
+        # The recursion can go through other rules, too.
+        g = """grammar = list:l end                    -> l ,
+               list    = items:is ',' 'x'           -> is + 'x'
+                       | 'x' ,
+               items   = ' '* list ,"""
+        self.check_match(g, 'x,x,x', out='xxx')
+        self.check_match(g, 'x,x,', returncode=1)
+
+    def test_right_recursive_lists(self):
+        g = """grammar = '[' items:is ']' end      -> join('/', is) ,
+               items   = item:i ',' items:is    -> [i] + is
+                       | item:i ','             -> [i]
+                       | item:i                 -> [i] ,
+               item    = ('a'..'z')+:cs         -> cat(cs) ,"""
+        self.check_match(g, '[a,bc,d]', out='a/bc/d')
+        self.check_match(g, '[a,bc,]', out='a/bc')
+        _, _, err = self.check_match(g, '[a,,]', returncode=1)
+        self.assertIn('Unexpected "," at column 4', err)
+
+        # The list is matched in a loop, so it can be longer than the
+        # recursion limit.
+        self.check_match(g, '[' + 'a,' * 5000 + ']', returncode=0)
+
+    def test_left_factoring(self):
+        g = """grammar = item:i end                 -> i ,
+               item    = 'a' 'b':x 'c'            -> x
+                       | 'a' 'b':y                -> [y]
+                       | 'a':p 'd'                -> p
+                       | 'a' ,"""
+        self.check_match(g, 'abc', out='b')
+        self.check_match(g, 'ab', out='[\n  "b"\n]')
+        self.check_match(g, 'ad', out='a')
+        self.check_match(g, 'a', out='a')
+        _, _, err = self.check_match(g, 'abd', returncode=1)
+        self.assertIn('Unexpected "d" at column 3', err)
+
+        # The alternatives aren't combined if the labels of one would be
+        # seen by another (here, `x` is otherwise a global variable).
+        files = {
+            'grammar.g': """grammar = 'a' 'b':x 'c' end -> x
+                                 | 'a' 'b' end      -> x ,""",
+            'input.txt': 'ab',
+        }
+        self.check_cmd(['-D', 'x="global"', '-i', 'input.txt', 'grammar.g'],
+                       files=files, returncode=0, out='global')
+
+        # Nor are labels renamed if they're used elsewhere in the rule.
+        self.check_match("grammar = ('a':y 'b' | 'a':x) -> x ,", 'a',
+                         out='a')
+
     def test_pred(self):
         self.check_match("grammar = ?( 1 ) end ,", '')
         self.check_match("grammar = ?( 0 ) end ,", '', returncode=1)
@@ -281,6 +1052,38 @@ class TestInterpreter(UnitTestMixin, CheckMixin, unittest.TestCase):
                                      'abd', returncode=1)
         self.assertIn('Unexpected "d" at column 3', err)
 
+    def test_error_positions_in_choices(self):
+        # These check that alternatives that are skipped because they
+        # can't start with the next character report the same errors as
+        # if they had been tried.
+        _, _, err = self.check_match("grammar = ('ab' | 'cd') end",
+                                     'x', returncode=1)
+        self.assertIn('Unexpected "x" at column 1', err)
+
+        _, _, err = self.check_match("grammar = ('ab' | 'cd') end",
+                                     'cx', returncode=1)
+        self.assertIn('Unexpected "x" at column 2', err)
+
+        _, _, err = self.check_match("grammar = ('a' 'b' | 'c' | 'd') 'e'",
+                                     'dx', returncode=1)
+        self.assertIn('Unexpected "x" at column 2', err)
+
+        # Alternatives that start with a lookahead are always tried, since
+        # it can look past the next character.
+        _, _, err = self.check_match(
+            "grammar = (~look 'aac' 'b' | 'a'..'c'*:x 'bc') end\n"
+            "look = anything?:y 'acb'\n", 'd', returncode=1)
+        self.assertIn('Unexpected end of input at column 2', err)
+
+    def test_choice_of_literals(self):
+        g = "grammar = ('abc' | 'x' | 'ab' | 'xyz'):s end -> s ,"
+        self.check_match(g, 'ab', out='ab')
+        self.check_match(g, 'xyz', returncode=1)
+        _, _, err = self.check_match(g, 'abd', returncode=1)
+        self.assertIn('Unexpected "d" at column 3', err)
+        _, _, err = self.check_match(g, 'q', returncode=1)
+        self.assertIn('Unexpected "q" at column 1', err)
+
     def test_weird_error_reporting_for_semantic_predicates(self):
         # You would think that you'd get 'Unexpected "2" at column 2 here.
         # You don't, because the parser consumes the 2 as part of `anything:x`
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import argparse
+import concurrent.futures
 import json
 import os
 import sys
@@ -30,6 +31,7 @@ if not d in sys.path:
 # that case).
 from glop.analyzer import Analyzer
 from glop.compiler import Compiler
+from glop.generator import Generator
 from glop.printer import Printer
 from glop.host import Host
 from glop.interpreter import Interpreter
@@ -55,6 +57,8 @@ def main(host=None, argv=None):
             return 0
         if args.compile:
             return _write_compiled_grammar(host, args, grammar)
+        if args.generate is not None:
+            return _generate_input(host, args, grammar)
         return _interpret_grammar(host, args, grammar)
 
     except KeyboardInterrupt:
@@ -69,14 +73,45 @@ def _parse_args(host, argv):
     ap.add_argument('-D', '--define', action='append', default=[],
                     help='Define a global var=value')
     ap.add_argument('-h', '--help', action='store_true')
-    ap.add_argument('-i', '--input', default='-')
+    ap.add_argument('-i', '--input', action='append', default=[])
+    ap.add_argument('-j', '--jobs', type=int, default=1, metavar='N')
     ap.add_argument('-o', '--output')
     ap.add_argument('-p', '--pretty-print', action='store_true')
+    ap.add_argument('-r', '--recursive', action='append', default=[],
+                    metavar='DIR')
     ap.add_argument('-V', '--version', action='store_true')
     ap.add_argument('--class-name', default='Parser')
     ap.add_argument('--memoize', action='store_true', default=True,
                     help='memoize intermediate results (on by default)')
     ap.add_argument('--no-memoize', dest='memoize', action='store_false')
+    ap.add_argument('--memo-limit', type=int, metavar='N',
+                    help='keep at most N memoized results per rule')
+    ap.add_argument('--incremental', action='store_true',
+                    help='generate a parser that supports reparse()')
+    ap.add_argument('--stream', action='store_true',
+                    help='read the input as it is parsed')
+    ap.add_argument('--mmap', action='store_true',
+                    help='map the input into memory and stream it')
+    ap.add_argument('--bytes', action='store_true',
+                    help='match bytes rather than decoded text')
+    ap.add_argument('--profile', action='store_true',
+                    help='report the time spent in each rule')
+    ap.add_argument('--profile-json', metavar='FILE',
+                    help='write the profile for each rule to FILE')
+    ap.add_argument('--heatmap', action='store_true',
+                    help='report the places matched most often')
+    ap.add_argument('--generate', type=int, metavar='N',
+                    help='write a random input of about N characters')
+    ap.add_argument('--seed', type=int,
+                    help='seed for the random input')
+    ap.add_argument('--cache-dir', metavar='DIR',
+                    help='cache compiled grammars in DIR')
+    ap.add_argument('--files-from', metavar='FILE',
+                    help='read the paths of the inputs from FILE')
+    ap.add_argument('--output-dir', metavar='DIR',
+                    help='write the result for each input under DIR')
+    ap.add_argument('--unordered', action='store_true',
+                    help='write the results as the inputs are parsed')
     ap.add_argument('--main', action='store_true', default=True,
                     help='generate a main() wrapper (on by default)')
     ap.add_argument('--no-main', dest='main', action='store_false')
@@ -85,21 +120,85 @@ def _parse_args(host, argv):
     args = ap.parse_args(argv)
 
     USAGE = '''\
-usage: glop [-chpV] [ -D var=value ] [-i file] [-o file] grammar
+usage: glop [-achpV] [-D var=value] [-i file] [-j N] [-o file] [-r dir]
+            [--class-name name] [--[no-]memoize] [--memo-limit N]
+            [--incremental] [--stream] [--mmap] [--bytes] [--profile]
+            [--profile-json file] [--heatmap] [--generate N] [--seed N]
+            [--cache-dir dir] [--files-from file] [--output-dir dir]
+            [--unordered] [--[no-]main] grammar
 
     -a, --ast                dump the ast of the parsed input
     -c, --compile            compile grammar instead of interpreting it
     -D, --define             define a global variable (-D var=value).
     -h, --help               show this message and exit
-    -i, --input              path to read input from
+    -i, --input              path to read input from (may be a glob, and
+                             may be given more than once)
+    -j, --jobs N             parse up to N inputs at once, in separate
+                             processes (defaults to 1), or, if there's
+                             only one input and the grammar's starting
+                             rule has a split annotation, parse pieces
+                             of the input in up to N processes
     -o, --output             path to write output to
     -p, --pretty-print       pretty-print grammar
+    -r, --recursive DIR      read every file under DIR as an input
     -V, --version            print current version (%s)
 
     --class-name CLASS_NAME  class name for the generated class when
                              compiling it (defaults to 'Parser')
     --[no-]memoize           memoize intermedate results (on by default)
+    --memo-limit N           keep at most N memoized results per rule, and
+                             discard the ones behind each completed item of
+                             the starting rule's top-level repetitions
+    --incremental            generate a parser with a reparse() method
+                             that reuses the results of the previous parse
+                             that weren't affected by an edit
+    --stream                 read the input as it is parsed rather than
+                             all up front (and generate a parser that can
+                             read from files, mmaps, and iterators of
+                             strings or UTF-8 encoded bytes)
+    --mmap                   map the input file into memory and decode
+                             it as it is parsed (implies --stream unless
+                             --bytes is given, in which case the bytes
+                             are matched in place)
+    --bytes                  match the input as bytes rather than text
+                             (characters in the grammar stand for the
+                             bytes with the same values)
+    --profile                count the calls to each rule, the time spent
+                             in it (with and without the rules it calls),
+                             the number of times it fails, and how often
+                             it is found in the memo cache, and print them
+                             when done (or, when compiling, generate a
+                             parser with a profile() method that returns
+                             them)
+    --profile-json FILE      write the profile to FILE as JSON (implies
+                             --profile)
+    --heatmap                count the number of times each rule is
+                             matched at each position (not counting
+                             memoized results), and print the places
+                             matched the most often, with the rules that
+                             were being matched when they were matched
+                             again (or, when compiling, generate a parser
+                             with a heatmap() method that returns them)
+    --generate N             write a random input that the grammar matches,
+                             with at least N characters if the grammar
+                             allows it (e.g., for benchmarks or fuzzing)
+    --seed N                 seed for the input written by --generate
+    --cache-dir DIR          cache the parsers compiled when interpreting
+                             grammars in DIR, so that they can be reused
+                             by later runs
+    --files-from FILE        read the paths of the inputs from FILE, one
+                             per line ('-' for stdin)
+    --output-dir DIR         write the result for each input to the file
+                             with the same path under DIR
+    --unordered              write the result for each input as soon as
+                             it is parsed rather than in the order of
+                             the inputs (with -j)
     --[no-]main              generate a main() wrapper (on by default)
+
+When there's more than one input (or -r, --files-from, or a glob is used),
+every input is parsed with the same parser, and the results are written as
+JSON lines of {"path": ..., "value": ...} or {"path": ..., "error": ...},
+unless --output-dir is given.
 ''' % VERSION
 
     if args.version:
@@ -114,6 +213,23 @@ usage: glop [-chpV] [ -D var=value ] [-i file] [-o file] grammar
         host.print_('Error: the following arguments are required: grammar')
         return None, 2
 
+    if args.jobs < 1:
+        host.print_('Error: the number of jobs must be at least 1',
+                    stream=host.stderr)
+        return None, 2
+
+    if args.profile_json:
+        args.profile = True
+
+    for flag in ('profile', 'heatmap'):
+        if getattr(args, flag) and args.jobs > 1 and not args.compile:
+            host.print_('Error: --%s can not be used with -j' % flag,
+                        stream=host.stderr)
+            return None, 2
+
+    if args.mmap and not args.bytes:
+        args.stream = True
+
     if not args.output:
         if args.compile:
             args.output = host.splitext(host.basename(args.grammar))[0] + '.py'
@@ -162,8 +278,21 @@ def _pretty_print_grammar(host, args, grammar):
     return 0
 
 
+def _generate_input(host, args, grammar):
+    global_vars = {}
+    for d in args.define:
+        k, v = d.split('=', 1)
+        global_vars[k] = json.loads(v)
+
+    generator = Generator(grammar, args.seed, global_vars)
+    _write(host, args.output, generator.generate(args.generate))
+    return 0
+
+
 def _write_compiled_grammar(host, args, grammar):
-    comp = Compiler(grammar, args.class_name, args.main, args.memoize)
+    comp = Compiler(grammar, args.class_name, args.main, args.memoize,
+                    args.memo_limit, args.incremental, args.stream,
+                    args.bytes, args.profile, args.heatmap)
     contents, err = comp.compile()
     if err:
         host.print_(err, stream=host.stderr)
@@ -175,30 +304,267 @@ def _write_compiled_grammar(host, args, grammar):
 
 
 def _interpret_grammar(host, args, grammar):
-    if args.input == '-':
-        path, contents = ('<stdin>', host.stdin.read())
-    else:
-        path, contents = (args.input, host.read_text_file(args.input))
+    inputs, is_batch, err = _inputs(host, args)
+    if err:
+        host.print_(err, stream=host.stderr)
+        return 1
 
     global_vars = {}
     for d in args.define:
         k, v = d.split('=', 1)
         global_vars[k] = json.loads(v)
 
-    out, err = Interpreter(grammar, args.memoize).interpret(
-        contents, path, global_vars
-    )[:2]
-    if err:
-        host.print_(err, stream=host.stderr)
-        return 1
+    interpreter = Interpreter(grammar, args.memoize, args.memo_limit,
+                              args.stream, args.bytes, args.cache_dir,
+                              args.profile, args.heatmap)
+    if is_batch:
+        returncode = _interpret_inputs(host, args, interpreter, inputs,
+                                       global_vars)
+    else:
+        out, err = _interpret_input(host, args, interpreter, inputs[0][0],
+                                    global_vars, args.jobs)
+        if err:
+            host.print_(err, stream=host.stderr)
+            returncode = 1
+        else:
+            _write(host, args.output, _format(out))
+            returncode = 0
+
+    for path, heatmap in interpreter.heatmaps:
+        host.print_(_heatmap_report(path, heatmap), end='',
+                    stream=host.stderr)
+    if interpreter.profile_stats:
+        host.print_(_profile_report(interpreter.profile_stats), end='',
+                    stream=host.stderr)
+    if args.profile_json:
+        _write(host, args.profile_json,
+               json.dumps(interpreter.profile_stats, indent=2,
+                          sort_keys=True) + '\n')
+    return returncode
+
+
+def _heatmap_report(path, heatmap):
+    """Returns a table of the places in the input that were matched the
+    most often."""
+    spots = heatmap['hotspots']
+    width = max(len(s['rule']) for s in spots + [{'rule': 'rule'}])
+    fmt = '%%-%ds %%6s %%6s %%8s  %%s\n' % width
+    text = '%s: %.2f rule attempts per character\n' % (
+        path, heatmap['attempts_per_char'])
+    text += fmt % ('rule', 'line', 'column', 'attempts', 'stack')
+    for s in spots:
+        text += fmt % (s['rule'], s['line'], s['column'], s['count'],
+                       ' > '.join(s['stack']) or '-')
+    return text
+
+
+def _profile_report(stats):
+    """Returns a table of the stats for each rule, with the rules that took
+    the most time (not counting the rules they called) first."""
+    rules = sorted(stats, key=lambda r: (-stats[r]['self_time'], r))
+    width = max(len(r) for r in ['rule'] + rules)
+    fmt = '%%-%ds %%10s %%10s %%10s %%10s %%10s\n' % width
+    text = fmt % ('rule', 'calls', 'time (s)', 'self (s)', 'backtracks',
+                  'memo hits')
+    for rule in rules:
+        s = stats[rule]
+        if s.get('memo_hits', 0) + s.get('memo_misses', 0):
+            hits = '%.1f%%' % (100.0 * s['memo_hits'] / s['calls'])
+        else:
+            hits = '-'
+        text += fmt % (rule, s['calls'], '%.4f' % s['time'],
+                       '%.4f' % s['self_time'], s['backtracks'], hits)
+    return text
+
+
+def _inputs(host, args):
+    """Returns a list of (path, name) pairs for the inputs, where `name`
+    is the path to write the result to under --output-dir, whether more
+    than one input could've been given, and an error message if a
+    pattern didn't match any files or two inputs would be written to the
+    same file."""
+    inputs = []
+    is_batch = (len(args.input) > 1 or args.recursive or
+                args.files_from is not None)
+    for path in args.input:
+        if path != '-' and any(ch in path for ch in '*?['):
+            is_batch = True
+            paths = host.glob(path)
+            if not paths:
+                return None, True, 'Error: no files match "%s"' % path
+            inputs.extend((p, p) for p in paths)
+        else:
+            inputs.append((path, path))
+    if args.files_from == '-':
+        inputs.extend((p, p) for p in host.stdin.read().splitlines() if p)
+    elif args.files_from is not None:
+        inputs.extend((p, p) for p in
+                      host.read_text_file(args.files_from).splitlines() if p)
+    for top in args.recursive:
+        inputs.extend((host.join(top, f), f)
+                      for f in sorted(host.files_under(top)))
+    if not is_batch and not inputs:
+        inputs = [('-', '-')]
+    if args.output_dir:
+        inputs, err = _output_names(host, args, inputs)
+        if err:
+            return None, is_batch, err
+    return inputs, is_batch, None
+
+
+def _output_names(host, args, inputs):
+    # Don't let the results be written outside of the directory, or let
+    # one overwrite another.
+    named = []
+    paths = {}
+    for path, name in inputs:
+        if name.startswith('/') or '..' in name.split('/'):
+            name = host.basename(name)
+        if paths.setdefault(name, path) != path:
+            return None, ('Error: "%s" and "%s" would both be written to '
+                          '"%s"' % (paths[name], path,
+                                    host.join(args.output_dir, name)))
+        named.append((path, name))
+    return named, None
+
+
+def _interpret_inputs(host, args, interpreter, inputs, global_vars):
+    if args.jobs > 1:
+        compiled_text, err = interpreter.compile()
+        if err:
+            host.print_(err, stream=host.stderr)
+            return 1
+        results = _results_in_parallel(host, args, interpreter, inputs,
+                                       global_vars, compiled_text)
+    else:
+        # The parser class is only compiled the first time, and then
+        # reused for the rest of the inputs.
+        results = ((path, name) + tuple(
+            _interpret_input(host, args, interpreter, path, global_vars))
+                   for path, name in inputs)
+
+    returncode = 0
+    lines = []
+    for path, name, out, err in results:
+        if err:
+            returncode = 1
+        if args.output_dir and err:
+            host.print_(err, stream=host.stderr)
+            continue
+        if args.output_dir:
+            out_path = host.join(args.output_dir, name)
+            host.maybe_mkdir(host.dirname(out_path))
+            _write(host, out_path, _format(out))
+            continue
+        if err:
+            line = json.dumps({'path': path, 'error': err}) + '\n'
+        else:
+            line = json.dumps({'path': path, 'value': out},
+                              sort_keys=True, default=_decode) + '\n'
+        if args.output == '-':
+            host.print_(line, end='')
+        else:
+            lines.append(line)
+    if not args.output_dir and args.output != '-':
+        _write(host, args.output, ''.join(lines))
+    return returncode
+
+
+def _results_in_parallel(host, args, interpreter, inputs, global_vars,
+                         compiled_text):
+    """Yields a (path, name, out, err) tuple for each input, parsing them
+    in a pool of worker processes.
+
+    The inputs are handed out in chunks, so that there's less overhead
+    per input when there are lots of small ones, but still enough chunks
+    to keep the workers busy if some inputs take longer than others."""
+    chunk_size = max(1, min(64, len(inputs) // (args.jobs * 8)))
+    with concurrent.futures.ProcessPoolExecutor(
+            args.jobs, initializer=_init_worker,
+            initargs=(host, args, global_vars, compiled_text)) as executor:
+        futures = {}
+        for i in range(0, len(inputs), chunk_size):
+            chunk = inputs[i:i + chunk_size]
+            paths = [path for path, _ in chunk]
+            if '-' in paths:
+                # The workers can't read from our stdin.
+                future = concurrent.futures.Future()
+                future.set_result([
+                    _interpret_input(host, args, interpreter, path,
+                                     global_vars) for path in paths])
+            else:
+                future = executor.submit(_interpret_in_worker, paths)
+            futures[future] = chunk
+        if args.unordered:
+            done = concurrent.futures.as_completed(futures)
+        else:
+            done = futures
+        for future in done:
+            for (path, name), result in zip(futures[future],
+                                            future.result()):
+                yield (path, name) + tuple(result)
+
+
+# The state of each worker process started by _results_in_parallel(). The
+# parser is compiled once, in the main process, and its source is then
+# exec'd once in each worker.
+_worker = {}
+
 
+def _init_worker(host, args, global_vars, compiled_text):
+    scope = {}
+    exec(compiled_text, scope)
+    interpreter = Interpreter(None, args.memoize)
+    interpreter.parser_cls = scope['Parser']
+    _worker.update(host=host, args=args, interpreter=interpreter,
+                   global_vars=global_vars)
+
+
+def _interpret_in_worker(paths):
+    return [_interpret_input(_worker['host'], _worker['args'],
+                             _worker['interpreter'], path,
+                             _worker['global_vars']) for path in paths]
+
+
+def _interpret_input(host, args, interpreter, path, global_vars, jobs=1):
+    if path == '-':
+        path = '<stdin>'
+        if args.stream:
+            contents = host.stdin
+        elif args.bytes:
+            contents = host.stdin.buffer.read()
+        else:
+            contents = host.stdin.read()
+    elif not host.exists(path):
+        return None, 'Error: no such file: "%s"' % path
+    elif args.mmap:
+        contents = host.map_file(path)
+    elif args.stream:
+        contents = host.open_text_file(path)
+    elif args.bytes:
+        contents = host.read_binary_file(path)
+    else:
+        contents = host.read_text_file(path)
+
+    try:
+        return interpreter.interpret(contents, path, global_vars, jobs)[:2]
+    finally:
+        if path != '<stdin>' and hasattr(contents, 'close'):
+            contents.close()
+
+
+def _format(out):
     if out is None:
-        out = ''
+        return ''
+    if isinstance(out, bytes):
+        return _decode(out)
     if not isinstance(out, basestring):
-        out = json.dumps(out, indent=2, sort_keys=True)
+        return json.dumps(out, indent=2, sort_keys=True, default=_decode)
+    return out
 
-    _write(host, args.output, out)
-    return 0
+
+def _decode(b):
+    return b.decode('utf-8', 'backslashreplace')
 
 
 def _write(host, path, contents):
@@ -9,7 +9,13 @@ eol         = '\x0D' '\x0A' | '\x0D' | '\x0A'
 comment     = '//' (~eol anything)* 
             | '/*' (~'*/' anything)* '*/'
 
-rule        = ident:i sp '=' sp choice:cs sp ','? -> ['rule', i, cs]
+rule        = ident:i sp annotation?:a '=' sp choice:cs sp ','?
+                                                  -> ['rule', i, cs] + a
+
+annotation  = '(' sp 'memo' sp ')' sp             -> 'memo'
+            | '(' sp 'nomemo' sp ')' sp           -> 'nomemo'
+            | '(' sp 'split' ws sp choice:c sp ')' sp
+                                                  -> ['split', c]
 
 ident       = id_start:hd id_continue*:tl         -> cat([hd] + tl)
 
@@ -32,9 +38,10 @@ post_op     = '?' | '*' | '+'
 
 prim_expr   = lit:i sp '..' sp lit:j              -> ['range', i, j]
             | lit:l                               -> l
-            | ident:i ~(sp '=')                   -> ['apply', i]
+            | ident:i ~(sp annotation? '=')       -> ['apply', i]
             | '->' sp ll_expr:e                   -> ['action', e]
             | '~' prim_expr:e                     -> ['not', e]
+            | '^'                                 -> ['cut']
             | '?(' sp ll_expr:e sp ')'            -> ['pred', e]
             | '(' sp choice:e sp ')'              -> ['paren', e]
 
@@ -74,3 +74,7 @@ frac         = '.' digit*:ds                        -> ''.join(ds),
 
 exp          = ('e'|'E') ('+'|'-'):s digit*:ds      -> 'e' + s + ''.join(ds)
              | ('e'|'E') digit*:ds                  -> 'e' + ''.join(ds),
+
+letter       = 'a'..'z' | 'A'..'Z',
+
+digit        = '0'..'9',
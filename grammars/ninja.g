@@ -1,24 +1,25 @@
-grammar  = (empty_line* ws decl)*:ds empty_line* end   -> ds,
+grammar (split '\n' ~' ')
+         = (empty_line* ws decl)*:ds empty_line* end   -> ds,
 
 decl     = build | rule | var | subninja | include
          | pool | default,
 
 build    = 'build' ws paths:os ws ':' ws name:rule
             explicit_deps:eds implicit_deps:ids order_only_deps:ods eol
-            (ws var)*:vs                               -> ['build', os, rule,
+            (indent var)*:vs                           -> ['build', os, rule,
                                                            eds, ids, ods, vs],
 
-rule     = 'rule' ws name:n eol (ws var)*:vs           -> ['rule', n, vs],
+rule     = 'rule' ws name:n eol (indent var)*:vs       -> ['rule', n, vs],
 
 var      = name:n ws '=' ws value:v eol                -> ['var', n, v],
 
-value    = (~eol ((ws -> '')|anything))*:vs            -> ''.join(vs),
+value    = (~eol ('$' '\n' ' '* -> '' | anything))*:vs -> ''.join(vs),
 
 subninja = 'subninja' ws path:p                        -> ['subninja', p],
 
 include  = 'include' ws path:p                         -> ['include', p],
 
-pool     = 'pool' ws name:n eol (ws var)*:vars         -> ['pool', n, vars],
+pool     = 'pool' ws name:n eol (indent var)*:vars     -> ['pool', n, vars],
 
 default  = 'default' ws paths:ps eol                   -> ['default', ps],
 
@@ -43,4 +44,10 @@ eol      = ws (comment | '\n'),
 
 ws       = (' '|('$' '\n'))*,
 
+indent   = ' '+,
+
+letter   = 'a'..'z' | 'A'..'Z',
+
+digit    = '0'..'9',
+
 comment  = '#' (~'\n' anything)* '\n',
@@ -4,3 +4,4 @@ chunk   = ~'$' anything:c       -> c
         | '$' '{' varname:v '}' -> scope[v]
         | '$' varname:v         -> scope[v],
 varname = (letter|'_')+:ls      -> ''.join(ls),
+letter  = 'a'..'z' | 'A'..'Z',